@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the ingest, load, and query paths on synthetic SSA shaped
+data, served from a local HTTP server so nothing touches the SSA website.
+
+    python benchmarks/run_benchmarks.py --years 1980 2020 --output out.json
+
+Results are written as JSON (one record per benchmark, with every timing
+in seconds) so they can be compared across versions.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.server
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+from ssas import ssa_data
+from query import name_query
+from timeseries import name_series
+from generate_names import slice_names, generate_names
+
+
+class _quiet_handler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(folder):
+    """
+    Description:
+        Serves folder over HTTP on a free local port in a daemon thread.
+
+    Returns:
+        (server, base url)
+    """
+    handler = partial(_quiet_handler, directory=folder)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def timed(function, repeat=1, setup=None):
+    """
+    Description:
+        Times function, calling setup (untimed) before every run.
+
+    Returns:
+        list of seconds of every run
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    return times
+
+
+def _quietly(function):
+    def wrapper(*args, **kwargs):
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                return function(*args, **kwargs)
+            finally:
+                sys.stdout = stdout
+    return wrapper
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+_criteria = {
+    'gender': dict(gender='F'),
+    'years': dict(year_start=1990, year_end=2000),
+    'letters': dict(gender='M', first_letter=['M', 'O', 'T']),
+    'rank': dict(gender='F', rank_lower_bound=500, rank_upper_bound=100,
+                 year_start=1990, year_end=2000),
+    'strict_rank': dict(gender='F', first_letter=['M', 'O', 'T'],
+                        rank_lower_bound=500, rank_upper_bound=100,
+                        year_start=1990, year_end=2000,
+                        strict_rank_criteria=True)
+}
+
+
+def run(years, names_per_year, state_list, repeat, processes, workdir):
+    """
+    Description:
+        Runs every benchmark.
+
+    Returns:
+        list of result dictionaries
+    """
+    results = []
+
+    def record(name, times, **extra):
+        results.append(dict(name=name, times=times, min=min(times),
+                            median=float(np.median(times)), **extra))
+        print('{:<40s} {:10.4f} s'.format(name, min(times)))
+
+    source = os.path.join(workdir, 'source')
+    data = os.path.join(workdir, 'data')+'/'
+    start = time.perf_counter()
+    synthetic.write_archives(source, years=years,
+                             names_per_year=names_per_year,
+                             state_list=state_list)
+    record('synthetic.write_archives', [time.perf_counter()-start])
+    server, url = serve(source)
+    try:
+        # Build the data folder once, then time each fetch from scratch
+        # (archives are already on disk, so the server answers 304)
+        data_obj = _quietly(ssa_data)(data, ssa_url=url)
+        for name, path in [('national', data_obj.national_path),
+                           ('state', data_obj.state_path)]:
+            fetch = getattr(data_obj, 'fetch_US_birth_'+name)
+            record('fetch_US_birth_'+name,
+                   timed(_quietly(partial(fetch, update=True)), repeat,
+                         setup=partial(shutil.rmtree, path)))
+            if processes > 1:
+                record('fetch_US_birth_{}[processes={}]'.format(name,
+                                                               processes),
+                       timed(_quietly(partial(fetch, update=True,
+                                              processes=processes)),
+                             repeat, setup=partial(shutil.rmtree, path)))
+        record('fetch_US_birth_state[no change]',
+               timed(_quietly(partial(data_obj.fetch_US_birth_state,
+                                      update=True)), repeat))
+        # Loading the parquet datasets
+        record('ssa_data.national', timed(
+            lambda: ssa_data(data, ssa_url=url).national, repeat))
+        record('ssa_data.state', timed(
+            lambda: ssa_data(data, ssa_url=url).state, repeat))
+        record('ssa_data.load_state[F, 2000-2020, CA]', timed(
+            lambda: data_obj.load_state(gender='F', year_start=2000,
+                                        year_end=2020, states='CA'),
+            repeat))
+        national = data_obj.national
+        rows = {'national_rows': len(national),
+                'state_rows': len(data_obj.state)}
+        # Queries
+        query = name_query(national)
+        for label, criteria in _criteria.items():
+            record('slice_names[{}]'.format(label), timed(
+                lambda: slice_names(national, **criteria), repeat))
+            query.cache_clear()
+            record('name_query.slice[{}, cold]'.format(label), timed(
+                lambda: query.slice(**criteria), 1))
+            record('name_query.slice[{}, cached]'.format(label), timed(
+                lambda: query.slice(**criteria), repeat))
+            record('generate_names[{}, n=10]'.format(label), timed(
+                lambda: generate_names(national, n=10, **criteria)
+                if len(query.names(**criteria)) >= 10 else None, repeat))
+        # history_plot data preparation of 40 names
+        names = national.loc[national['gender']=='F', 'name'].astype(str)
+        names = list(names.unique()[:40])
+
+        def history_prep():
+            # What history_plot does before drawing
+            index = name_series(national[national['name'].isin(names)],
+                                columns=['f'])
+            return [index.series(name, 'F', column='f') for name in names]
+
+        record('history_plot prep[40 names]', timed(history_prep, repeat))
+        index = name_series(national)
+        record('name_series.batch[40 names]', timed(
+            lambda: index.batch(names, 'F'), repeat))
+    finally:
+        server.shutdown()
+    return results, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', nargs=2, type=int, default=[1980, 2020],
+                        help='first and last year of synthetic data')
+    parser.add_argument('--names', type=int, default=2000,
+                        help='names per gender per year (national)')
+    parser.add_argument('--states', type=int, default=10,
+                        help='number of states in the state archive')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of every benchmark')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='worker processes of the parallel ingests')
+    parser.add_argument('--output', default='bench_output.json',
+                        help='JSON file results are written to')
+    args = parser.parse_args()
+    years = range(args.years[0], args.years[1]+1)
+    state_list = synthetic.states[:args.states]
+    workdir = tempfile.mkdtemp(prefix='baby_names_bench_')
+    try:
+        results, rows = run(years, args.names, state_list, args.repeat,
+                            args.processes, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'version': _version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scale': dict(years=[years[0], years[-1]], names_per_year=args.names,
+                      states=len(state_list), **rows),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('Results written to {}'.format(args.output))
+    return
+
+
+if __name__ == '__main__':
+    main()
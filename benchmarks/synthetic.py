@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import zipfile
+import numpy as np
+
+
+# Every state file of the SSA archive (50 states and DC)
+states = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA',
+          'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', 'ME',
+          'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM',
+          'NV', 'NY', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX',
+          'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY']
+
+_onsets = ['', 'B', 'Br', 'C', 'Ch', 'D', 'El', 'F', 'G', 'H', 'J', 'K', 'L',
+           'M', 'N', 'P', 'R', 'S', 'Sh', 'T', 'V', 'W', 'Z']
+_vowels = ['a', 'e', 'i', 'o', 'u', 'ay', 'ee', 'ia']
+_codas = ['', 'n', 'l', 'r', 's', 'th', 'x', 'nd', 'lyn', 'son', 'ette']
+
+
+def vocabulary(size, rng):
+    """
+    Description:
+        Makes a vocabulary of distinct, pronounceable looking names.
+
+    Arguments:
+        size: number of names
+        rng: numpy random generator
+
+    Returns:
+        list of names
+    """
+    names = set()
+    while len(names) < size:
+        syllables = rng.integers(1, 4)
+        name = ''.join(rng.choice(_onsets)+rng.choice(_vowels)
+                       for _ in range(syllables))+rng.choice(_codas)
+        names.add(name[0].upper()+name[1:].lower())
+    return sorted(names)
+
+
+def _counts(rng, size, scale):
+    """
+    Description:
+        Zipf like occurrences of size names, none below the SSA's
+        publication threshold of five.
+    """
+    rank = np.arange(1, size+1)
+    counts = scale/rank**rng.uniform(0.9, 1.1)+rng.integers(0, 3, size)
+    return np.maximum(counts.astype('int64'), 5)
+
+
+def _year_table(rng, vocab, names_per_year, scale):
+    """
+    Description:
+        Names and occurrences of a year, a list of (gender, name, n) sorted
+        like the SSA files (by gender, then n descending, then name).
+    """
+    rows = []
+    for gender in ['F', 'M']:
+        size = min(names_per_year, len(vocab[gender]))
+        picks = rng.choice(len(vocab[gender]), size=size, replace=False)
+        counts = _counts(rng, size, scale)
+        order = np.lexsort((np.array(vocab[gender])[picks], -counts))
+        rows += [(gender, vocab[gender][picks[i]], int(counts[i]))
+                 for i in order]
+    return rows
+
+
+def write_archives(folder, years=range(1880, 2021), names_per_year=2000,
+                   state_list=None, names_per_state=None, seed=0):
+    """
+    Description:
+        Writes SSA shaped data into folder, laid out like the SSA website:
+        'numberUSbirths.html', 'names.zip' of 'yobYYYY.txt' files, and
+        'state/namesbystate.zip' of 'XX.TXT' files. Point ssa_data's
+        ssa_url at a server of folder to fetch it.
+
+    Arguments:
+        folder: directory written to
+
+    Keyword arguments:
+        years: years of data
+        names_per_year: names of each gender in each national year file
+        state_list: states of the state archive (Default: all states)
+        names_per_state: names of each gender in each state and year
+            (Default: a tenth of names_per_year)
+        seed: seed of the random number generator
+
+    Returns:
+        Nothing
+    """
+    rng = np.random.default_rng(seed)
+    state_list = states if state_list is None else state_list
+    if names_per_state is None:
+        names_per_state = max(1, names_per_year//10)
+    vocab = {'F': vocabulary(int(1.5*names_per_year), rng)}
+    vocab['M'] = vocabulary(int(1.5*names_per_year), rng)
+    os.makedirs(os.path.join(folder, 'state'), exist_ok=True)
+    totals = []
+    with zipfile.ZipFile(os.path.join(folder, 'names.zip'), 'w',
+                         zipfile.ZIP_DEFLATED) as archive:
+        for year in years:
+            rows = _year_table(rng, vocab, names_per_year, 50000)
+            archive.writestr('yob{:d}.txt'.format(year), ''.join(
+                '{},{},{}\r\n'.format(name, gender, n)
+                for gender, name, n in rows
+            ))
+            male = sum(n for gender, _, n in rows if gender == 'M')
+            female = sum(n for gender, _, n in rows if gender == 'F')
+            # Not every birth makes it into the published name data
+            totals.append((year, int(1.08*male), int(1.1*female)))
+        archive.writestr('NationalReadMe.pdf', b'')
+    with zipfile.ZipFile(os.path.join(folder, 'state', 'namesbystate.zip'),
+                         'w', zipfile.ZIP_DEFLATED) as archive:
+        for state in state_list:
+            lines = []
+            tables = {year: _year_table(rng, vocab, names_per_state, 2000)
+                      for year in years}
+            for gender in ['F', 'M']:
+                for year in years:
+                    lines += ['{},{},{},{},{}\r\n'.format(state, gender, year,
+                                                          name, n)
+                              for g, name, n in tables[year] if g == gender]
+            archive.writestr('{}.TXT'.format(state), ''.join(lines))
+        archive.writestr('StateReadMe.pdf', b'')
+    with open(os.path.join(folder, 'numberUSbirths.html'), 'w') as f:
+        f.write('<table>\n<tr><th>Year of birth</th><th>Male</th>'
+                '<th>Female</th><th>Total</th></tr>\n')
+        for year, male, female in totals:
+            f.write('<tr><td>{}</td><td>{:,}</td><td>{:,}</td><td>{:,}</td>'
+                    '</tr>\n'.format(year, male, female, male+female))
+        f.write('</table>\n')
+    return
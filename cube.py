@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+import pandas as pd
+
+from instrument import span
+from datastore import atomic_path
+
+
+class state_cube:
+    """
+    Description:
+        A sparse state by year by (name, gender) cube of the state data.
+        Every cell observed is stored once, with integer codes of its
+        state, year, and (name, gender) pair, sorted so the cells of a name
+        are a single slice. Queries of a name across states (its share of
+        births in every state relative to all states, state rankings, and
+        choropleth arrays) are then array operations over that slice.
+
+    Arguments:
+        df: pandas dataframe of SSA state data, with at least the 'state',
+            'name', 'gender', 'year_int' (or 'year'), 'n', and 'f' columns
+
+    Attributes:
+        keys: dataframe of the 'name' and 'gender' of every pair
+        states: array of the states
+        years: array of the years
+        totals: 3D array of the names recorded in every state, gender
+            ('F', 'M'), and year, the denominator of 'f'
+        source: dictionary describing the data the cube is of (saved along
+            with it)
+
+    Notes:
+        ^Fractions of a year range are occurrences over names recorded in
+         the range. Shares compare a state's fraction to the fraction of
+         all states together, so both undercount births the same way (see
+         ssa_data.fetch_US_birth_state).
+    """
+    _arrays = ['key', 'state', 'year', 'n', 'f']
+
+    def __init__(self, df):
+        with span('state_cube', rows=len(df)):
+            if 'year_int' in df.columns:
+                year = df['year_int'].values.astype('int64')
+            else:
+                year = df['year'].dt.year.values.astype('int64')
+            states = df['state'].astype('category')
+            names = df['name'].astype('category')
+            genders = df['gender'].astype(pd.CategoricalDtype(['F', 'M']))
+            pairs = (names.cat.codes.values.astype('int64')*2
+                     + genders.cat.codes.values)
+            pairs, key = np.unique(pairs, return_inverse=True)
+            self.keys = pd.DataFrame({
+                'name': pd.Categorical.from_codes(
+                    pairs//2, names.cat.categories).remove_unused_categories(),
+                'gender': pd.Categorical.from_codes(pairs%2, ['F', 'M'])
+            })
+            self.states = np.asarray(states.cat.categories, dtype=str)
+            year_min = year.min() if len(year) else 0
+            self.years = np.arange(year_min, year.max()+1 if len(year) else 0)
+            state = states.cat.codes.values
+            order = np.lexsort((year, state, key))
+            self.key = key[order].astype('int32')
+            self.state = state[order].astype('int16')
+            self.year = (year[order]-year_min).astype('int16')
+            self.n = df['n'].values[order].astype('int32')
+            self.f = df['f'].values[order].astype('float32')
+            self.source = {}
+            self._index()
+        return
+
+
+    def _index(self):
+        """
+        Description:
+            Builds the lookups derived from the cells: the slice of every
+            pair, the row of every (name, gender), and the totals.
+
+        Returns:
+            Nothing
+        """
+        self._starts = np.searchsorted(self.key, np.arange(len(self.keys)+1))
+        self._rows = {key: row for row, key in
+                      enumerate(zip(self.keys['name'].astype(str),
+                                    self.keys['gender'].astype(str)))}
+        shape = (len(self.states), 2, len(self.years))
+        gender = self.keys['gender'].cat.codes.values[self.key]
+        cell = (self.state.astype('int64')*2+gender)*len(self.years)+self.year
+        self.totals = np.bincount(cell, weights=self.n,
+                                  minlength=int(np.prod(shape))).reshape(shape)
+        return
+
+
+    def row(self, name, gender):
+        """
+        Description:
+            Row of a (name, gender) pair in keys.
+
+        Returns:
+            row (int), or None if the name is not in the cube
+        """
+        return self._rows.get((name, gender))
+
+
+    def _cells(self, name, gender):
+        row = self.row(name, gender)
+        if row is None:
+            raise KeyError('{} ({}) is not in the state data'.format(name,
+                                                                    gender))
+        return slice(self._starts[row], self._starts[row+1])
+
+
+    def _cols(self, year_start, year_end):
+        lo = 0 if year_start is None else max(year_start-self.years[0], 0)
+        hi = (len(self.years) if year_end is None
+              else min(year_end-self.years[0]+1, len(self.years)))
+        return lo, max(hi, lo)
+
+
+    def array(self, name, gender, column='n'):
+        """
+        Description:
+            Dense state by year array of a name.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Keyword arguments:
+            column: 'n' or 'f'
+
+        Returns:
+            2D float array, a row per state and a column per year, NaN
+            where the name was not recorded
+        """
+        cells = self._cells(name, gender)
+        array = np.full((len(self.states), len(self.years)), np.nan)
+        array[self.state[cells], self.year[cells]] = getattr(self,
+                                                             column)[cells]
+        return array
+
+
+    def shares(self, name, gender, year_start=None, year_end=None):
+        """
+        Description:
+            Occurrences, fraction, and share of a name in every state over
+            a range of years. The share is the state's fraction over the
+            fraction of all states together, so a share above 1 means the
+            name is over represented in the state.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Keyword arguments:
+            year_start: first year to consider
+            year_end: last year to consider
+
+        Returns:
+            dataframe indexed by state, of 'n', 'f', and 'share'
+        """
+        cells = self._cells(name, gender)
+        lo, hi = self._cols(year_start, year_end)
+        year = self.year[cells]
+        keep = (year >= lo) & (year < hi)
+        n = np.bincount(self.state[cells][keep], weights=self.n[cells][keep],
+                        minlength=len(self.states))
+        g = 0 if gender == 'F' else 1
+        totals = self.totals[:, g, lo:hi].sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.where(totals > 0, n/totals, 0.)
+            share = f/(n.sum()/totals.sum())
+        return pd.DataFrame({'n': n.astype('int64'), 'f': f,
+                             'share': np.nan_to_num(share)},
+                            index=pd.Index(self.states, name='state'))
+
+
+    def rankings(self, name, gender, year_start=None, year_end=None,
+                 column='share'):
+        """
+        Description:
+            States ranked by how popular a name is in them over a range of
+            years, e.g., the states leading a trend.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Keyword arguments:
+            year_start: first year to consider
+            year_end: last year to consider
+            column: column to rank states by ('n', 'f', or 'share')
+
+        Returns:
+            dataframe of shares (see shares) sorted by column, with the
+            'rank' of every state
+        """
+        df = self.shares(name, gender, year_start=year_start,
+                         year_end=year_end)
+        df = df.sort_values(column, ascending=False, kind='stable')
+        return df.assign(rank=df[column].rank(method='min', ascending=False)
+                         .astype('int64'))
+
+
+    def choropleth(self, name, gender, year_start=None, year_end=None,
+                   column='share'):
+        """
+        Description:
+            Values of a name over a range of years for every state, aligned
+            with states, ready to color a map with.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Keyword arguments:
+            year_start: first year to consider
+            year_end: last year to consider
+            column: 'n', 'f', or 'share'
+
+        Returns:
+            array aligned with states
+        """
+        return self.shares(name, gender, year_start=year_start,
+                           year_end=year_end)[column].values
+
+
+    def save(self, path):
+        """
+        Description:
+            Atomically saves the cube (and its source) as a .npz file.
+
+        Arguments:
+            path: path of the file
+
+        Returns:
+            Nothing
+        """
+        with atomic_path(path) as tmp, open(tmp, 'wb') as f:
+            np.savez(f, names=np.asarray(self.keys['name'], dtype=str),
+                     genders=np.asarray(self.keys['gender'], dtype=str),
+                     states=self.states, years=self.years,
+                     source=json.dumps(self.source),
+                     **{a: getattr(self, a) for a in self._arrays})
+        return
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Description:
+            Loads a cube saved with save.
+
+        Arguments:
+            path: path of the file
+
+        Returns:
+            state_cube
+        """
+        cube = cls.__new__(cls)
+        with span('state_cube_load', path=path), np.load(path) as npz:
+            cube.keys = pd.DataFrame({
+                'name': pd.Categorical(npz['names']),
+                'gender': pd.Categorical(npz['genders'], categories=['F', 'M'])
+            })
+            cube.states = npz['states']
+            cube.years = npz['years']
+            cube.source = json.loads(str(npz['source']))
+            for array in cls._arrays:
+                setattr(cube, array, npz[array])
+            cube._index()
+        return cube
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from instrument import span
+
+
+# Rows per parquet row group, small enough that readers can skip the row
+# groups that cannot satisfy their filters
+row_group_size = 2**16
+
+# Compact column schemas of the tables saved by ssa_data. Column order is
+# the order columns are written to (and read back from) disk.
+_gender_dtype = pd.CategoricalDtype(['F', 'M'])
+
+national_schema = {
+    'name': 'category',
+    'gender': _gender_dtype,
+    'n': 'int32',
+    'year': 'datetime64[ns]',
+    'year_int': 'int16',
+    'f': 'float32',
+    'rank': 'int32'
+}
+
+state_schema = {
+    'state': 'category',
+    'gender': _gender_dtype,
+    'year': 'datetime64[ns]',
+    'year_int': 'int16',
+    'name': 'category',
+    'n': 'int32',
+    'f': 'float32',
+    'rank': 'int32'
+}
+
+# Per (name, gender) summaries of the national data, and per (state, name,
+# gender) summaries of the state data
+national_summary_schema = {
+    'name': 'category',
+    'gender': _gender_dtype,
+    'first_year': 'int16',
+    'last_year': 'int16',
+    'peak_year': 'int16',
+    'best_rank': 'int32',
+    'worst_rank': 'int32',
+    'total_n': 'int64',
+    'peak_f': 'float32'
+}
+
+state_summary_schema = dict(state='category', **national_summary_schema)
+
+
+# Columns the national and state datasets are partitioned by on disk
+national_partitioning = ['year_int']
+state_partitioning = ['state', 'year_int']
+
+_partition_types = {
+    'state': pa.string(),
+    'year_int': pa.int16()
+}
+
+_manifest_file = '_manifest.json'
+# Directory of the summaries of every member of a dataset, ignored by
+# readers of the dataset like the manifest
+_summary_dir = '_summary'
+
+
+def year_timestamps(year_int):
+    """
+    Description:
+        Converts integer years to timestamps at the start of each year
+        without round tripping through strings.
+
+    Arguments:
+        year_int: array-like of integer years
+
+    Returns:
+        numpy array of datetime64[ns]
+    """
+    years = np.asarray(year_int, dtype='int64')-1970
+    return years.astype('datetime64[Y]').astype('datetime64[ns]')
+
+
+def to_schema(df, schema):
+    """
+    Description:
+        Casts a dataframe to one of the compact table schemas. If the
+        dataframe lacks the small-int 'year_int' column it is derived from
+        'year' (int, str, or datetime), and 'year' is rebuilt from it.
+
+    Arguments:
+        df: dataframe of SSA baby name data
+        schema: dictionary of column name to dtype (e.g., national_schema)
+
+    Returns:
+        dataframe with only the schema's columns, in order, and dtypes
+    """
+    if 'year_int' not in df.columns:
+        year = df['year']
+        if pd.api.types.is_datetime64_any_dtype(year):
+            year_int = year.dt.year
+        else:
+            year_int = pd.to_numeric(year)
+        df = df.assign(year_int=year_int.astype(schema['year_int']))
+    df = df.assign(year=year_timestamps(df['year_int'].values))
+    return df[list(schema)].astype(schema)
+
+
+def summarize(df):
+    """
+    Description:
+        Summarizes the history of every (name, gender) pair, or (state,
+        name, gender) triple of state data: first and last year observed,
+        peak year (of the highest fraction), best and worst rank, total
+        occurrences, and peak fraction.
+
+    Arguments:
+        df: dataframe of SSA baby name data
+
+    Returns:
+        dataframe of national_summary_schema (or state_summary_schema),
+        sorted by its keys
+    """
+    keys = [k for k in ['state', 'name', 'gender'] if k in df.columns]
+    if 'year_int' in df.columns:
+        year = df['year_int'].values
+    else:
+        year = df['year'].dt.year.values
+    df = pd.DataFrame({k: df[k].values for k in keys+['n', 'f', 'rank']})
+    df['year_int'] = year
+    groups = df.groupby(keys, observed=True, sort=True)
+    summary = groups.agg(first_year=('year_int', 'min'),
+                         last_year=('year_int', 'max'),
+                         best_rank=('rank', 'min'),
+                         worst_rank=('rank', 'max'),
+                         total_n=('n', 'sum'),
+                         peak_f=('f', 'max'))
+    summary['peak_year'] = year[groups['f'].idxmax().values]
+    summary = summary.reset_index()
+    if 'state' in keys:
+        schema = state_summary_schema
+    else:
+        schema = national_summary_schema
+    return summary[list(schema)].astype(schema)
+
+
+def merge_summaries(summaries):
+    """
+    Description:
+        Merges summaries (see summarize) of disjoint parts of a table, e.g.,
+        of the members of an SSA archive, into the summary of the whole
+        table, without reading the table itself.
+
+    Arguments:
+        summaries: list of summary dataframes
+
+    Returns:
+        dataframe of national_summary_schema (or state_summary_schema),
+        sorted by its keys
+    """
+    df = pd.concat(summaries, ignore_index=True)
+    keys = [k for k in ['state', 'name', 'gender'] if k in df.columns]
+    # Ties of the peak fraction go to the earliest year, as in summarize
+    df = df.sort_values('peak_year', kind='stable', ignore_index=True)
+    groups = df.groupby(keys, observed=True, sort=True)
+    summary = groups.agg(first_year=('first_year', 'min'),
+                         last_year=('last_year', 'max'),
+                         best_rank=('best_rank', 'min'),
+                         worst_rank=('worst_rank', 'max'),
+                         total_n=('total_n', 'sum'))
+    peak = groups['peak_f'].idxmax().values
+    summary['peak_f'] = df['peak_f'].values[peak]
+    summary['peak_year'] = df['peak_year'].values[peak]
+    summary = summary.reset_index()
+    if 'state' in keys:
+        schema = state_summary_schema
+    else:
+        schema = national_summary_schema
+    return summary[list(schema)].astype(schema)
+
+
+def _filters(year_start=None, year_end=None, gender=None, states=None,
+             names=None):
+    """
+    Description:
+        Builds the row filters passed down to the parquet reader from the
+        user's criteria.
+
+    Keyword arguments:
+        year_start: first year to read
+        year_end: last year to read
+        gender: gender to read (str or list of str)
+        states: states to read (str or list of str)
+        names: names to read (str or list of str)
+
+    Returns:
+        list of (column, op, value) tuples (None if there are no filters)
+    """
+    filters = []
+    if year_start is not None:
+        filters.append(('year_int', '>=', int(year_start)))
+    if year_end is not None:
+        filters.append(('year_int', '<=', int(year_end)))
+    for column, value in [('gender', gender), ('state', states),
+                          ('name', names)]:
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        filters.append((column, 'in', list(value)))
+    return filters if filters else None
+
+
+def read_table(path, columns=None, year_start=None, year_end=None,
+               gender=None, states=None, names=None):
+    """
+    Description:
+        Reads a table saved by ssa_data, only decoding the requested
+        columns and the row groups that can satisfy the criteria.
+
+    Arguments:
+        path: path of the parquet table
+
+    Keyword arguments:
+        columns: columns to read (Default: all columns)
+        year_start: first year to read
+        year_end: last year to read
+        gender: gender to read (str or list of str)
+        states: states to read, only for state data (str or list of str)
+        names: names to read (str or list of str)
+
+    Returns:
+        dataframe of the matching rows
+    """
+    with span('read_table', path=path, columns=columns):
+        return _read_table(path, columns, _filters(
+            year_start=year_start, year_end=year_end, gender=gender,
+            states=states, names=names
+        ))
+
+
+def _read_table(path, columns, filters):
+    if not os.path.isdir(path):
+        # Single file tables (e.g., totals or data saved before partitioning)
+        df = pd.read_parquet(path, columns=columns, filters=filters)
+        if filters is not None:
+            df.reset_index(drop=True, inplace=True)
+        return df
+    if not table_exists(path):
+        raise FileNotFoundError('Dataset was never completely built: '
+                                '{}'.format(path))
+    keys = read_manifest(path)['partitioning']
+    schema = state_schema if 'state' in keys else national_schema
+    partitioning = ds.partitioning(
+        pa.schema([(key, _partition_types[key]) for key in keys]),
+        flavor='hive'
+    )
+    df = pd.read_parquet(path, columns=columns, filters=filters,
+                         partitioning=partitioning)
+    columns = [c for c in schema if c in df.columns]
+    return df[columns].astype({c: schema[c] for c in columns})
+
+
+def _source_signature(path):
+    """
+    Description:
+        Signature of a table's source on disk, which changes whenever the
+        table's data changes. A dataset is signed by the contents of its
+        manifest, which holds the digest of every part, so an update that
+        changes nothing keeps its caches valid. A single file table is
+        signed by its modification time and size.
+
+    Arguments:
+        path: path of the parquet table (file or dataset directory)
+
+    Returns:
+        signature (bytes)
+    """
+    manifest = os.path.join(path, _manifest_file)
+    if os.path.isdir(path) and os.path.isfile(manifest):
+        with open(manifest, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return '{}:{}'.format(os.path.abspath(path), digest).encode()
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_mtime_ns,
+                             stat.st_size).encode()
+
+
+def read_cached(path):
+    """
+    Description:
+        Reads a full table through an uncompressed Arrow IPC cache written
+        next to it (path+'.arrow'). The cache is memory-mapped, so reading
+        it decodes nothing, and processes on the same host share its pages
+        through the OS page cache. The cache is (re)written from the parquet
+        table when it is missing or its source has changed. If it cannot be
+        written (e.g., a read-only data folder), the table read from parquet
+        is returned instead.
+
+    Arguments:
+        path: path of the parquet table (file or dataset directory)
+
+    Returns:
+        dataframe of the table
+    """
+    cache = path.rstrip('/')+'.arrow'
+    signature = _source_signature(path)
+    if os.path.isfile(cache):
+        with span('mmap_read', path=cache):
+            reader = pa.ipc.open_file(pa.memory_map(cache))
+            if reader.schema.metadata.get(b'source') == signature:
+                return reader.read_all().to_pandas(split_blocks=True)
+    df = read_table(path)
+    with span('mmap_write', path=cache):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata(
+            dict(table.schema.metadata, source=signature)
+        )
+        # Readers mapping an older cache keep its pages until they let go
+        try:
+            with atomic_path(cache) as tmp, pa.OSFile(tmp, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        except OSError:
+            pass
+    return df
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Description:
+        Temporary path to write a file to, moved in place of path once
+        written (and removed if writing fails). The name is unique to the
+        writer, so concurrent writers of path do not clobber each other's
+        file, and starts with '.', so readers ignore it until it is moved.
+        E.g., `with atomic_path(path) as tmp: df.to_parquet(tmp)`.
+
+    Arguments:
+        path: path of the file
+
+    Returns:
+        context manager of the temporary path (str)
+    """
+    dir_, base = os.path.split(path)
+    # Not tempfile.mkstemp, its files are only readable by their owner
+    tmp = os.path.join(dir_, '.{:s}.{:d}.{:s}'.format(base, os.getpid(),
+                                                      os.urandom(4).hex()))
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return
+
+
+def write_table(df, path):
+    """
+    Description:
+        Atomically writes (or replaces) a single file table.
+
+    Arguments:
+        df: dataframe to write
+        path: path of the parquet file
+
+    Returns:
+        Nothing
+    """
+    with span('parquet_write', path=path, rows=len(df)), \
+         atomic_path(path) as tmp:
+        df.to_parquet(tmp, index=False, row_group_size=row_group_size)
+    return
+
+
+def part_name(keys, values, part):
+    """
+    Description:
+        Name of a part of a partition relative to its dataset, e.g.,
+        'state=WY/year_int=1990/part-F'. The part's file is the name with
+        a '.parquet' suffix.
+
+    Arguments:
+        keys: partition columns (list of str)
+        values: values of the partition columns (list)
+        part: name of the part within its partition (str)
+
+    Returns:
+        part name (str)
+    """
+    return '/'.join(['{}={}'.format(key, value)
+                     for key, value in zip(keys, values)]+[part])
+
+
+def table_exists(path):
+    """
+    Description:
+        If a table was completely saved. A dataset directory only counts
+        once its manifest is written, which is the last step of a build, so
+        an interrupted build is rebuilt rather than read.
+
+    Arguments:
+        path: path of the parquet table (file or dataset directory)
+
+    Returns:
+        boolean
+    """
+    if os.path.isdir(path):
+        return os.path.isfile(os.path.join(path, _manifest_file))
+    return os.path.isfile(path)
+
+
+def read_manifest(path):
+    """
+    Description:
+        Reads the manifest of a partitioned dataset, which records how the
+        dataset is partitioned, a digest of every archive member it was
+        built from, and the member and digest of the source data of every
+        part, so updates can skip the members and parts that have not
+        changed.
+
+    Arguments:
+        path: directory of the dataset
+
+    Returns:
+        manifest dictionary (empty partitions if there is no manifest)
+    """
+    file_ = os.path.join(path, _manifest_file)
+    if not os.path.isfile(file_):
+        return {'partitioning': [], 'members': {}, 'parts': {}}
+    with open(file_) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    """
+    Description:
+        Atomically writes the manifest of a partitioned dataset.
+
+    Arguments:
+        path: directory of the dataset
+        manifest: manifest dictionary
+
+    Returns:
+        Nothing
+    """
+    file_ = os.path.join(path, _manifest_file)
+    with atomic_path(file_) as tmp, open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return
+
+
+def member_summary_path(path, member):
+    """
+    Description:
+        Path of the summary of a single member of a dataset (see
+        merge_summaries).
+
+    Arguments:
+        path: directory of the dataset
+        member: name of the member (e.g., 'yob1990.txt' or 'WY.TXT')
+
+    Returns:
+        path of the summary file
+    """
+    return os.path.join(path, _summary_dir, member+'.parquet')
+
+
+def prepare_dataset(path):
+    """
+    Description:
+        Makes sure path is a dataset directory. A single file table left
+        by an older version is removed, as it has to be fully rebuilt.
+
+    Arguments:
+        path: directory of the dataset
+
+    Returns:
+        Nothing
+    """
+    if os.path.isfile(path):
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+    return
+
+
+def write_part(df, path, part, keys):
+    """
+    Description:
+        Writes (or replaces) a single part of a dataset. Partition columns
+        are encoded in the directory name and not in the file.
+
+    Arguments:
+        df: dataframe holding only the part's rows
+        path: directory of the dataset
+        part: name of the part (see part_name)
+        keys: partition columns (list of str)
+
+    Returns:
+        Nothing
+    """
+    df = df.drop(columns=keys)
+    # Do not repeat the dictionary of every name in every part
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            if df[column].dtype != _gender_dtype:
+                df[column] = df[column].cat.remove_unused_categories()
+    # Parts must share one schema, so use the same dictionary index type
+    # however many categories a part has
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(pa.schema(
+        [pa.field(field.name, pa.dictionary(pa.int32(),
+                                            field.type.value_type))
+         if pa.types.is_dictionary(field.type) else field
+         for field in table.schema],
+        metadata=table.schema.metadata
+    ))
+    file_ = os.path.join(path, part+'.parquet')
+    os.makedirs(os.path.dirname(file_), exist_ok=True)
+    with span('parquet_write', part=part, rows=len(table)), \
+         atomic_path(file_) as tmp:
+        pq.write_table(table, tmp, row_group_size=row_group_size)
+    return
+
+
+def remove_part(path, part):
+    """
+    Description:
+        Removes a single part of a dataset, along with any partition
+        directories left empty.
+
+    Arguments:
+        path: directory of the dataset
+        part: name of the part (see part_name)
+
+    Returns:
+        Nothing
+    """
+    file_ = os.path.join(path, part+'.parquet')
+    if os.path.isfile(file_):
+        os.remove(file_)
+    dir_ = os.path.dirname(file_)
+    while (os.path.abspath(dir_) != os.path.abspath(path)
+           and os.path.isdir(dir_) and not os.listdir(dir_)):
+        os.rmdir(dir_)
+        dir_ = os.path.dirname(dir_)
+    return
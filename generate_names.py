@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 
+import os
 import numpy as np
 import pandas as pd
 
 from utils import *
+from query import name_query
+from instrument import span
+from datastore import read_table
 
 
 def slice_names(df, gender=None, first_letter=None, rank_lower_bound=None,
                 rank_upper_bound=None, year_start=None, year_end=None,
-                strict_rank_criteria=False):
+                strict_rank_criteria=False, first_year_start=None,
+                first_year_end=None, peak_year_start=None, peak_year_end=None,
+                total_n_min=None, summary=None, prefix=None, suffix=None,
+                sounds_like=None):
     """
     Description:
         Slices data to conforms to the user's desired criteria.
 
     Arguments:
-        df: pandas dataframe of SSA baby name data
+        df: pandas dataframe of SSA baby name data, a name_query of it
+            (results are cached, e.g., ssa_data.national_query), or path of
+            a saved table (only partitions satisfying gender and years are
+            read)
 
     Keyword arguments:
         gender: gender to restrict results to
@@ -25,13 +35,33 @@ def slice_names(df, gender=None, first_letter=None, rank_lower_bound=None,
         year_end: last year to consider
         strict_rank_criteria: reject name if rank criteria not satisified
             across all years in consideration (boolean)
+        first_year_start: restrict to names first seen in or after year
+        first_year_end: restrict to names first seen in or before year
+        peak_year_start: restrict to names that peaked in or after year
+        peak_year_end: restrict to names that peaked in or before year
+        total_n_min: restrict to names with at least this many occurrences
+            over all years
+        summary: summary table of df used by the criteria above, e.g.,
+            ssa_data.national_summary (Default: summarized from df, a
+            name_query uses its own)
+        prefix: restrict to names starting with prefix, case insensitive
+            (list of str or str, e.g., 'Mar')
+        suffix: restrict to names ending with suffix, case insensitive
+            (list of str or str, e.g., 'lyn')
+        sounds_like: restrict to names with the same Soundex code as name
+            (list of str or str, e.g., 'Catherine')
+
+    Notes:
+        ^Summary criteria are judged over the whole history of a name, not
+         only the years between year_start and year_end.
 
     Returns:
         sliced dataframe
     """
     # ERROR check
-    if not isinstance(df, pd.DataFrame):
-        print('ERROR: 1st argument must be a pandas dataframe.')
+    if not isinstance(df, (pd.DataFrame, name_query, str, os.PathLike)):
+        print('ERROR: 1st argument must be a pandas dataframe, name_query, '
+              'or path.')
         return
     if gender is not None and gender != 'M' and gender != 'F':
         print('ERROR: There are only two genders: M and F.')
@@ -49,52 +79,54 @@ def slice_names(df, gender=None, first_letter=None, rank_lower_bound=None,
         temp = rank_lower_bound
         rank_lower_bound = rank_upper_bound
         rank_upper_bound = temp
-    # Enforce first_letter being list
-    if first_letter is not None:
-        first_letter = list(first_letter)
-    # slice by gender
-    if gender is not None:
-        df = df[df['gender']==gender]
-    # slice by years
-    if year_start is not None:
-        df = df[df['year'].dt.year>=year_start]
-    if year_end is not None:
-        df = df[df['year'].dt.year<=year_end]
-    # slice by first letter
-    if first_letter is not None:
-        df = df[df['name'].astype(str).str[0].isin(first_letter)]
-    # slice by rank (Rank 1 is HIGHER than Rank 500, i.e., 1 > 500)
-    if rank_lower_bound is not None:
-        if strict_rank_criteria:
-            temp = df.copy()
-            df = df[df['rank']<=rank_lower_bound]
-            temp = temp[temp['rank']>rank_lower_bound]
-            intersection = np.intersect1d(df['name'].values,temp['name'].values)
-            df = df[~df['name'].isin(intersection)]
-        else:
-            df = df[df['rank']<=rank_lower_bound]
-    if rank_upper_bound is not None:
-        if strict_rank_criteria:
-            temp = df.copy()
-            df = df[df['rank']>=rank_upper_bound]
-            temp = temp[temp['rank']<rank_upper_bound]
-            intersection = np.intersect1d(df['name'].values,temp['name'].values)
-            df = df[~df['name'].isin(intersection)]
-        else:
-            df = df[df['rank']>=rank_upper_bound]
-    return df
+    criteria = dict(gender=gender, first_letter=first_letter,
+                    rank_lower_bound=rank_lower_bound,
+                    rank_upper_bound=rank_upper_bound,
+                    year_start=year_start, year_end=year_end,
+                    strict_rank_criteria=strict_rank_criteria,
+                    first_year_start=first_year_start,
+                    first_year_end=first_year_end,
+                    peak_year_start=peak_year_start,
+                    peak_year_end=peak_year_end, total_n_min=total_n_min,
+                    prefix=prefix, suffix=suffix, sounds_like=sounds_like)
+    summarized = summary is not None or all(
+        value is None for value in [first_year_start, first_year_end,
+                                    peak_year_start, peak_year_end,
+                                    total_n_min]
+    )
+    with span('slice_names', source=type(df).__name__):
+        # Query engines cache their results
+        if isinstance(df, name_query):
+            return df.slice(**criteria)
+        # Scan only the partitions of a saved table that are needed, every
+        # column is read so the slice matches that of a dataframe
+        if not isinstance(df, pd.DataFrame):
+            if summarized:
+                df = read_table(df, year_start=year_start, year_end=year_end,
+                                gender=gender)
+            else:
+                # Summarizing needs every year of the names
+                df = read_table(df, gender=gender)
+        # Compile all criteria into a single pass over the dataframe
+        with span('compile'):
+            query = name_query(df, cache_size=0, summary=summary)
+        return query.slice(**criteria)
 
 
 def generate_names(df, n=None, pout=False, gender=None, first_letter=None,
                    rank_lower_bound=None, rank_upper_bound=None,
-                   year_start=None, year_end=None, strict_rank_criteria=False):
+                   year_start=None, year_end=None, strict_rank_criteria=False,
+                   first_year_start=None, first_year_end=None,
+                   peak_year_start=None, peak_year_end=None, total_n_min=None,
+                   summary=None, prefix=None, suffix=None, sounds_like=None):
     """
     Description:
         Generates names that conforms to the user's desired criteria. Can
         return all matches or randomly draw from sample.
 
     Arguments:
-        df: pandas dataframe of SSA baby name data
+        df: pandas dataframe of SSA baby name data, a name_query of it, or
+            path of a saved table
 
     Keyword arguments:
         n: number of random draws (Default: report all matches)
@@ -107,6 +139,18 @@ def generate_names(df, n=None, pout=False, gender=None, first_letter=None,
         year_end: last year to consider
         strict_rank_criteria: reject name if rank criteria not satisified
             across all years in consideration (boolean)
+        first_year_start: restrict to names first seen in or after year
+        first_year_end: restrict to names first seen in or before year
+        peak_year_start: restrict to names that peaked in or after year
+        peak_year_end: restrict to names that peaked in or before year
+        total_n_min: restrict to names with at least this many occurrences
+            over all years
+        summary: summary table of df used by the criteria above (see
+            slice_names)
+        prefix: restrict to names starting with prefix (list of str or str)
+        suffix: restrict to names ending with suffix (list of str or str)
+        sounds_like: restrict to names sounding like name (list of str or
+            str)
 
     Returns:
         array of names that satisfy criteria
@@ -115,7 +159,13 @@ def generate_names(df, n=None, pout=False, gender=None, first_letter=None,
                      rank_lower_bound=rank_lower_bound,
                      rank_upper_bound=rank_upper_bound,
                      year_start=year_start, year_end=year_end,
-                     strict_rank_criteria=strict_rank_criteria)
+                     strict_rank_criteria=strict_rank_criteria,
+                     first_year_start=first_year_start,
+                     first_year_end=first_year_end,
+                     peak_year_start=peak_year_start,
+                     peak_year_end=peak_year_end, total_n_min=total_n_min,
+                     summary=summary, prefix=prefix, suffix=suffix,
+                     sounds_like=sounds_like)
     if n is not None:
         # Drop duplicates as to not weight by popularity over the years
         names = df.drop_duplicates(subset=['name'])['name'].sample(n=n).values
@@ -124,4 +174,121 @@ def generate_names(df, n=None, pout=False, gender=None, first_letter=None,
     names = np.sort(names)
     if pout:
         wraprint(', '.join(names))
-    return names
\ No newline at end of file
+    return names
+
+
+class name_sampler:
+    """
+    Description:
+        A reusable sampler of names that conform to the user's desired
+        criteria. The deduplicated pool of candidate names is built once,
+        after which many random draws are served in a single vectorized
+        call. Draws are without replacement, like generate_names.
+
+    Arguments:
+        df: pandas dataframe of SSA baby name data, a name_query of it, or
+            path of a saved table (see slice_names)
+
+    Keyword arguments:
+        weights: weight candidates by popularity, either by their summed
+            occurrences ('n') or their mean fraction ('f') over the sliced
+            data, which must have that column (Default: all candidates
+            equally likely)
+        seed: seed of the random number generator (int or
+            numpy.random.Generator)
+        criteria: keyword arguments of slice_names (e.g., gender='F')
+
+    Attributes:
+        names: sorted array of candidate names
+        p: probability of drawing each candidate first (None if unweighted)
+    """
+    def __init__(self, df, weights=None, seed=None, **criteria):
+        if weights is not None and weights != 'n' and weights != 'f':
+            raise ValueError("weights must be None, 'n', or 'f'")
+        df = slice_names(df, **criteria)
+        if df is None:
+            raise ValueError('invalid criteria')
+        if weights is not None and weights not in df.columns:
+            raise ValueError('data has no {!r} column to weight '
+                             'by'.format(weights))
+        if weights is None:
+            self.names = np.sort(np.asarray(df['name'].unique(), dtype=str))
+            self.p = None
+            self._log_w = None
+        else:
+            groups = df.groupby(df['name'].astype(str), observed=True,
+                                sort=True)[weights]
+            w = (groups.sum() if weights == 'n' else groups.mean())
+            self.names = np.asarray(w.index, dtype=str)
+            w = w.values.astype('float64')
+            self.p = w/w.sum()
+            self._log_w = np.log(w)
+        self.rng = np.random.default_rng(seed)
+        return
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def _draw_rows(self, n, size):
+        """
+        Description:
+            Draws size samples of n distinct candidates, by the Gumbel
+            top-k trick, which draws without replacement (weighted or not)
+            in blocks of rows. Small unweighted draws are first made with
+            replacement and rejected if they repeat a candidate, which is
+            the same distribution when all candidates are equally likely
+            (weighted, it is not sequential draws without replacement).
+
+        Arguments:
+            n: number of candidates in each draw
+            size: number of draws
+
+        Returns:
+            2D array of candidate positions, a row per draw
+        """
+        pool = len(self.names)
+        out = np.empty((size, n), dtype='int64')
+        todo = np.arange(size)
+        if self._log_w is None and n*n <= pool:
+            for _ in range(3):
+                draws = self.rng.choice(pool, size=(len(todo), n), p=self.p)
+                draws_sorted = np.sort(draws, axis=1)
+                unique = (draws_sorted[:, 1:] != draws_sorted[:, :-1]).all(1)
+                out[todo[unique]] = draws[unique]
+                todo = todo[~unique]
+                if len(todo) == 0:
+                    return out
+        block = max(1, 2**22//pool)
+        for start in range(0, len(todo), block):
+            rows = todo[start:start+block]
+            keys = self.rng.gumbel(size=(len(rows), pool))
+            if self._log_w is not None:
+                keys += self._log_w
+            out[rows] = np.argpartition(-keys, n-1, axis=1)[:, :n]
+        return out
+
+
+    def draw(self, n, size=None):
+        """
+        Description:
+            Randomly draws n names from the candidates.
+
+        Arguments:
+            n: number of names in a draw
+
+        Keyword arguments:
+            size: number of independent draws (Default: a single draw)
+
+        Returns:
+            sorted array of n names, or if size is given a 2D array of
+            size rows of n sorted names
+        """
+        if n > len(self.names):
+            raise ValueError('Cannot draw {:d} names from {:d} candidates.'
+                             .format(n, len(self.names)))
+        rows = np.sort(self._draw_rows(n, 1 if size is None else size),
+                       axis=1)
+        names = self.names[rows]
+        return names[0] if size is None else names
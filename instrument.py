@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where spans go without max_rss_kb
+    resource = None
+
+
+# Spans are only recorded while enabled, otherwise span() hands back a
+# shared do-nothing context manager
+_enabled = False
+_sinks = []
+_trace_memory = False
+_local = threading.local()
+
+
+def _max_rss_kb():
+    """
+    Description:
+        Peak resident memory of the process in kB (None if unknown).
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other Unixes kB
+    return max_rss//1024 if sys.platform == 'darwin' else max_rss
+
+
+class _null_span:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def tag(self, **tags):
+        return
+
+
+_null = _null_span()
+
+
+class _span:
+    """
+    Description:
+        A timed span of a stage. On exit a record of the span is sent to
+        every sink: its name, tags, parent span, wall clock start, elapsed
+        seconds, peak resident memory of the process (where the platform
+        reports it), and (if memory is traced) the peak bytes allocated by
+        Python during the span.
+    """
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+        return
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self._parent = stack[-1].name if stack else None
+        if _trace_memory and tracemalloc.is_tracing():
+            # Fold the peak so far into the parent before resetting it
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak,
+                                      tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._peak = 0
+        stack.append(self)
+        self._start = time.time()
+        self._clock = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter()-self._clock
+        stack = _local.stack
+        stack.pop()
+        record = {
+            'span': self.name,
+            'parent': self._parent,
+            'start': self._start,
+            'seconds': seconds,
+            'pid': os.getpid()
+        }
+        max_rss_kb = _max_rss_kb()
+        if max_rss_kb is not None:
+            record['max_rss_kb'] = max_rss_kb
+        if _trace_memory and tracemalloc.is_tracing():
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            record['peak_traced_bytes'] = peak
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.tags)
+        for sink in _sinks:
+            sink(record)
+        return False
+
+
+def span(name, **tags):
+    """
+    Description:
+        Times a stage, e.g., `with span('parquet_write', part=part):`.
+        Costs a function call when instrumentation is disabled.
+
+    Arguments:
+        name: name of the stage
+
+    Keyword arguments:
+        tags: extra fields of the span's record
+
+    Returns:
+        context manager (has a tag(**tags) method to add fields)
+    """
+    if not _enabled:
+        return _null
+    return _span(name, tags)
+
+
+def enable(*sinks, memory=False):
+    """
+    Description:
+        Starts recording spans.
+
+    Arguments:
+        sinks: callables each record (a dictionary) is passed to, e.g.,
+            log_sink(), json_sink(path), or a list's append
+
+    Keyword arguments:
+        memory: trace Python allocations for per-span peak memory, this
+            slows down allocation heavy code (boolean)
+
+    Returns:
+        Nothing
+    """
+    global _enabled, _trace_memory
+    _sinks[:] = sinks
+    _trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = bool(_sinks)
+    return
+
+
+def disable():
+    """
+    Description:
+        Stops recording spans (and tracing memory, if enable started it).
+
+    Returns:
+        Nothing
+    """
+    global _enabled, _trace_memory
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _trace_memory = False
+    _sinks[:] = []
+    return
+
+
+def log_sink(logger='baby_names', level=logging.INFO):
+    """
+    Description:
+        Sink logging every record as a JSON structured message.
+
+    Keyword arguments:
+        logger: name of the logger
+        level: level the records are logged at
+
+    Returns:
+        sink
+    """
+    log = logging.getLogger(logger)
+
+    def sink(record):
+        log.log(level, json.dumps(record))
+    return sink
+
+
+def json_sink(path):
+    """
+    Description:
+        Sink appending every record as a line of JSON to a file. Safe to
+        share between threads and processes.
+
+    Arguments:
+        path: path of the file
+
+    Returns:
+        sink
+    """
+    lock = threading.Lock()
+
+    def sink(record):
+        line = json.dumps(record)+'\n'
+        with lock, open(path, 'a') as f:
+            f.write(line)
+    return sink
+
+
+# Worker processes (and services) can be instrumented from the environment
+if os.environ.get('BABY_NAMES_TRACE'):
+    enable(json_sink(os.environ['BABY_NAMES_TRACE']),
+           memory=bool(os.environ.get('BABY_NAMES_TRACE_MEMORY')))
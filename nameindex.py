@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import weakref
+from functools import cached_property
+
+import numpy as np
+
+from instrument import span
+
+
+# American Soundex digits, letters not listed (vowels, H, W, Y) have none
+_soundex_digits = dict(zip('BFPVCGJKQSXZDTLMNR', '111122222222334556'))
+
+
+def soundex(name):
+    """
+    Description:
+        American Soundex code of a name, e.g., 'Robert' and 'Rupert' are
+        both 'R163'.
+
+    Arguments:
+        name: name to code
+
+    Returns:
+        four character code (str), empty if name has no letters
+    """
+    letters = [c for c in name.upper() if 'A' <= c <= 'Z']
+    if not letters:
+        return ''
+    code = letters[0]
+    last = _soundex_digits.get(letters[0], '')
+    for c in letters[1:]:
+        digit = _soundex_digits.get(c, '')
+        if digit and digit != last:
+            code += digit
+        # H and W do not separate letters of the same digit, vowels do
+        if c not in 'HW':
+            last = digit
+    return (code+'000')[:4]
+
+
+class name_index:
+    """
+    Description:
+        An index of distinct names resolving prefix, suffix, and sounds
+        like (Soundex) matches to sets of names. Prefixes and suffixes are
+        looked up by binary search of the sorted names (and of the sorted
+        reversed names), sounds like matches in a map of Soundex code to
+        names (built the first time it is used). Matching is case
+        insensitive.
+
+    Arguments:
+        names: array of distinct names (e.g., the categories of the 'name'
+            column of SSA baby name data)
+
+    Attributes:
+        names: array of the names, the positions returned are into it
+    """
+    def __init__(self, names):
+        self.names = np.asarray(names, dtype=str)
+        with span('name_index', names=len(self.names)):
+            lower = np.char.lower(self.names)
+            self._prefix_order = np.argsort(lower, kind='stable')
+            self._prefixes = lower[self._prefix_order]
+            reverse = np.array([name[::-1] for name in lower], dtype=str)
+            self._suffix_order = np.argsort(reverse, kind='stable')
+            self._suffixes = reverse[self._suffix_order]
+        return
+
+
+    @cached_property
+    def _sounds(self):
+        with span('soundex_index', names=len(self.names)):
+            codes = np.array([soundex(name) for name in self.names],
+                             dtype=str)
+            order = np.argsort(codes, kind='stable')
+            keys, starts = np.unique(codes[order], return_index=True)
+            return dict(zip(keys, np.split(order, starts[1:])))
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    @staticmethod
+    def _range(keys, order, key):
+        key = key.lower()
+        lo = np.searchsorted(keys, key, side='left')
+        hi = np.searchsorted(keys, key+'\U0010ffff', side='left')
+        return order[lo:hi]
+
+
+    def prefix(self, prefix):
+        """
+        Description:
+            Names starting with prefix (e.g., 'Mar').
+
+        Returns:
+            array of positions of the names
+        """
+        return self._range(self._prefixes, self._prefix_order, prefix)
+
+
+    def suffix(self, suffix):
+        """
+        Description:
+            Names ending with suffix (e.g., 'lyn').
+
+        Returns:
+            array of positions of the names
+        """
+        return self._range(self._suffixes, self._suffix_order, suffix[::-1])
+
+
+    def sounds_like(self, name):
+        """
+        Description:
+            Names with the same Soundex code as name.
+
+        Returns:
+            array of positions of the names
+        """
+        return self._sounds.get(soundex(name), np.empty(0, dtype='int64'))
+
+
+    def mask(self, prefix=None, suffix=None, sounds_like=None):
+        """
+        Description:
+            Names satisfying every given criterion, where a criterion given
+            as a list is satisfied by any of its values.
+
+        Keyword arguments:
+            prefix: prefix of names (str or list of str)
+            suffix: suffix of names (str or list of str)
+            sounds_like: names the names sound like (str or list of str)
+
+        Returns:
+            boolean array over names
+        """
+        mask = np.ones(len(self.names), dtype=bool)
+        for lookup, values in [(self.prefix, prefix), (self.suffix, suffix),
+                               (self.sounds_like, sounds_like)]:
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            match = np.zeros(len(self.names), dtype=bool)
+            for value in values:
+                match[lookup(value)] = True
+            mask &= match
+        return mask
+
+
+# Indexes of the name categories alive, by id of the categories
+_indexes = {}
+
+
+def index_of(categories):
+    """
+    Description:
+        name_index of the categories of a categorical 'name' column, built
+        once and shared while the categories are alive. A dataframe, its
+        slices, and every name_query of them share the same categories, so
+        queries of the same data do not rebuild the index.
+
+    Arguments:
+        categories: pandas Index of distinct names
+
+    Returns:
+        name_index
+    """
+    key = id(categories)
+    entry = _indexes.get(key)
+    if entry is not None and entry[0]() is categories:
+        return entry[1]
+    index = name_index(categories)
+    _indexes[key] = (weakref.ref(categories,
+                                 lambda _, key=key: _indexes.pop(key, None)),
+                     index)
+    return index
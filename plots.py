@@ -1,15 +1,40 @@
 #!/usr/bin/env python
 
 import pandas as pd
-import matplotlib.pyplot as plt
 
+from timeseries import name_series
 
-cc = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+
+_cc = None
 markers = ['o', 'v', '^', '<', '>', '8', 's', 'p', 'P', '*', 'h', 'H', 'X', 'D',
            'd', '.', '1', '2', '3', '4', '+', 'x']
 child_gender_dict = {'M':'Boy', 'F':'Girl'}
 
 
+def _colors():
+    """
+    Description:
+        Colors of matplotlib's property cycle. matplotlib is imported the
+        first time a plot is made, not with this module.
+
+    Returns:
+        list of colors
+    """
+    global _cc
+    if _cc is None:
+        import matplotlib.pyplot as plt
+        _cc = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    return _cc
+
+
+def __getattr__(name):
+    # plots.cc is still available, but only looked up when asked for
+    if name == 'cc':
+        return _colors()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,
+                                                                     name))
+
+
 def history_plot(ax, names, genders, df, plot_type='f', log_scale=True,
                  ts_min=None, ts_max=None, legend=True, highlight=None,
                  **plot_kwargs):
@@ -22,7 +47,9 @@ def history_plot(ax, names, genders, df, plot_type='f', log_scale=True,
         ax: ax that is plotted to
         names: list of names to plot data for
         genders: list of gender of name (if str or len=1, assumes single gender)
-        df: dataframe from which data is extracted from
+        df: dataframe from which data is extracted from (national data, or
+            the data of a single state), or a prebuilt name_series index of
+            it (e.g., ssa_data.national_series)
         
     Keyword arguments:
         plot_type: column of dataframe to be plotted as a function of time
@@ -37,8 +64,9 @@ def history_plot(ax, names, genders, df, plot_type='f', log_scale=True,
         Nothing
     """
     # ERROR check
-    if not isinstance(df, pd.DataFrame):
-        print('ERROR: 4th argument must be a pandas dataframe.')
+    if not isinstance(df, (pd.DataFrame, name_series)):
+        print('ERROR: 4th argument must be a pandas dataframe or '
+              'name_series.')
         return
     if type(genders) is str:
         genders = [genders]*len(names)
@@ -47,23 +75,29 @@ def history_plot(ax, names, genders, df, plot_type='f', log_scale=True,
     elif len(genders) != len(names):
         print('ERROR: len(genders) match len(names) or be length one.')
         return
+    cc = _colors()
     if len(names) > len(cc)*len(markers):
         print('WARNNING: Number of names exceed unquie identifiers.')
+    # Index the names' gap filled histories in a single pass
+    if isinstance(df, pd.DataFrame):
+        df = df[df['name'].isin(names)]
+        if 'state' in df.columns and df['state'].nunique() > 1:
+            print('ERROR: dataframe has more than one state, slice it to a '
+                  'single state.')
+            return
+        df = name_series(df, columns=[plot_type])
+    elif plot_type not in df.arrays:
+        print('ERROR: name_series has no {:s} column, build it with '
+              'columns including it.'.format(plot_type))
+        return
     # Make plot
     for i, (gender, name) in enumerate(zip(genders, names)):
         # Loop through names and genders
-        data = df.loc[(df['name'] == name) & (df['gender'] == gender)]
-        # Fixup missing data
-        dates = pd.date_range(start=data['year'].iloc[0].date(),
-                              end=data['year'].iloc[-1].date(), freq='YS')
-        s = pd.Series(index=dates, dtype=dates.dtype)
-        data.set_index('year',inplace=True)
-        data = pd.concat([data, s[~s.index.isin(data.index)]]).sort_index()
-        data = data.drop([0], axis=1)
-        data.loc[:, 'name'] = name
-        data.loc[:, 'gender'] = gender
-        data['year'] = data.index
-        data.reset_index(inplace=True, drop=True)
+        series = df.series(name, gender, column=plot_type)
+        if series is None:
+            print('WARNING: {:s} ({:s}) not found.'.format(name, gender))
+            continue
+        data = {'year': series.index, plot_type: series.values}
         # Add name to plot
         if plot_type == 'rank':
             p = ax.plot(data['year'], data[plot_type], c=cc[i%len(cc)],
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+from functools import lru_cache, cached_property
+
+import numpy as np
+import pandas as pd
+
+from instrument import span
+from datastore import summarize
+from nameindex import index_of
+
+
+class name_query:
+    """
+    Description:
+        A compiled query engine over SSA baby name data. The columns the
+        criteria of slice_names filter on are precomputed once (name codes,
+        first-letter codes, gender masks, and integer years), every query
+        is then combined into a single row mask, and the selected rows are
+        cached for repeated queries. Summary criteria (first year, peak
+        year, total occurrences) are resolved on the summary table of df
+        and mapped back to its rows, and prefix, suffix, and sounds like
+        criteria on a name_index of the distinct names.
+
+    Arguments:
+        df: pandas dataframe of SSA baby name data
+
+    Keyword arguments:
+        cache_size: number of query results kept in the LRU cache (0 for
+            no caching)
+        summary: summary table of df, see datastore.summarize (Default:
+            summarized from df the first time a summary criterion is used)
+
+    Attributes:
+        df: dataframe the engine queries
+        index: name_index of the distinct names of df (built on first use,
+            and shared by the engines of data with the same categories)
+
+    Notes:
+        ^The engine assumes df is not modified after it is built.
+    """
+    def __init__(self, df, cache_size=128, summary=None):
+        self.df = df
+        self._summary = summary
+        self._summary_rows = None
+        names = df['name']
+        if not isinstance(names.dtype, pd.CategoricalDtype):
+            names = names.astype('category')
+        self._name_codes = names.cat.codes.values
+        self._name_categories = names.cat.categories
+        letters = pd.Categorical(self._name_categories.astype(str).str[0])
+        self._letter_categories = letters.categories
+        self._letter_codes = letters.codes[self._name_codes]
+        self._genders = {gender: (df['gender']==gender).values
+                         for gender in ['M', 'F']}
+        if 'year_int' in df.columns:
+            self._year = df['year_int'].values
+        else:
+            self._year = df['year'].dt.year.values
+        self._rank = df['rank'].values
+        self._rows = lru_cache(maxsize=cache_size)(self._compile)
+        self._names = lru_cache(maxsize=cache_size)(self._unique_names)
+        return
+
+
+    @staticmethod
+    def _key(gender=None, first_letter=None, rank_lower_bound=None,
+             rank_upper_bound=None, year_start=None, year_end=None,
+             strict_rank_criteria=False, first_year_start=None,
+             first_year_end=None, peak_year_start=None, peak_year_end=None,
+             total_n_min=None, prefix=None, suffix=None, sounds_like=None):
+        """
+        Description:
+            Normalizes the criteria of a query into a hashable cache key,
+            so equivalent queries share a cached result.
+
+        Returns:
+            tuple of the criteria
+        """
+        if first_letter is not None:
+            first_letter = tuple(sorted(set(first_letter)))
+        if isinstance(prefix, str):
+            prefix = [prefix]
+        if isinstance(suffix, str):
+            suffix = [suffix]
+        if isinstance(sounds_like, str):
+            sounds_like = [sounds_like]
+        if prefix is not None:
+            prefix = tuple(sorted(set(p.lower() for p in prefix)))
+        if suffix is not None:
+            suffix = tuple(sorted(set(s.lower() for s in suffix)))
+        if sounds_like is not None:
+            sounds_like = tuple(sorted(set(sounds_like)))
+        if rank_lower_bound is None and rank_upper_bound is None:
+            strict_rank_criteria = False
+        return (gender, first_letter, rank_lower_bound, rank_upper_bound,
+                year_start, year_end, bool(strict_rank_criteria),
+                first_year_start, first_year_end, peak_year_start,
+                peak_year_end, total_n_min, prefix, suffix, sounds_like)
+
+
+    def _compile(self, key):
+        """
+        Description:
+            Combines all the criteria of a query into a single row mask.
+
+        Arguments:
+            key: normalized criteria (see _key)
+
+        Returns:
+            read-only array of the selected rows
+        """
+        (gender, first_letter, rank_lower_bound, rank_upper_bound,
+         year_start, year_end, strict_rank_criteria) = key[:7]
+        summary_criteria = key[7:12]
+        prefix, suffix, sounds_like = key[12:]
+        mask = np.ones(len(self.df), dtype=bool)
+        if gender is not None:
+            with span('filter', step='gender'):
+                mask &= self._genders[gender]
+        if year_start is not None or year_end is not None:
+            with span('filter', step='year'):
+                if year_start is not None:
+                    mask &= self._year >= year_start
+                if year_end is not None:
+                    mask &= self._year <= year_end
+        if first_letter is not None:
+            with span('filter', step='first_letter'):
+                letters = np.isin(self._letter_categories, first_letter)
+                mask &= letters[self._letter_codes]
+        if prefix is not None or suffix is not None or sounds_like is not None:
+            with span('filter', step='name_index'):
+                names = self.index.mask(prefix=prefix, suffix=suffix,
+                                        sounds_like=sounds_like)
+                mask &= names[self._name_codes]
+        if any(value is not None for value in summary_criteria):
+            with span('filter', step='summary'):
+                mask &= self._summary_mask(*summary_criteria)
+        if rank_lower_bound is not None or rank_upper_bound is not None:
+            with span('filter', step='rank', strict=strict_rank_criteria):
+                if (strict_rank_criteria and self._summary is not None
+                    and 'state' not in self._summary.columns
+                    and gender is not None and year_start is None
+                    and year_end is None):
+                    # Lifetime best and worst ranks are in the summary
+                    mask &= self._summary_mask(
+                        best_rank_min=rank_upper_bound,
+                        worst_rank_max=rank_lower_bound
+                    )
+                else:
+                    self._rank_mask(mask, rank_lower_bound,
+                                    rank_upper_bound, strict_rank_criteria)
+        rows = np.flatnonzero(mask)
+        rows.setflags(write=False)
+        return rows
+
+
+    def _rank_mask(self, mask, rank_lower_bound, rank_upper_bound,
+                   strict_rank_criteria):
+        """
+        Description:
+            Applies the rank criteria to a row mask, in place. Strict rank
+            criteria are resolved with the per-name worst and best rank of
+            the rows already selected.
+
+        Returns:
+            Nothing
+        """
+        # Rank 1 is HIGHER than Rank 500, i.e., 1 > 500
+        if strict_rank_criteria:
+            codes = self._name_codes[mask]
+            rank = self._rank[mask]
+            keep = np.ones(len(self._name_categories), dtype=bool)
+            if rank_lower_bound is not None:
+                worst = np.full(len(keep), -np.inf)
+                np.maximum.at(worst, codes, rank)
+                keep &= worst <= rank_lower_bound
+            if rank_upper_bound is not None:
+                best = np.full(len(keep), np.inf)
+                np.minimum.at(best, codes, rank)
+                keep &= best >= rank_upper_bound
+            mask[mask] = keep[codes]
+        else:
+            if rank_lower_bound is not None:
+                mask &= self._rank <= rank_lower_bound
+            if rank_upper_bound is not None:
+                mask &= self._rank >= rank_upper_bound
+        return
+
+
+    @cached_property
+    def index(self):
+        return index_of(self._name_categories)
+
+
+    def _summary_index(self):
+        """
+        Description:
+            Summary table of df and the summary row of every row of df,
+            matched on the integer codes of the summary's keys (name,
+            gender, and state of state data). Built on first use.
+
+        Returns:
+            (summary dataframe, array of the summary row of every row, -1
+            if a row has none)
+        """
+        if self._summary_rows is not None:
+            return self._summary_rows
+        with span('summary_index'):
+            summary = self._summary
+            if summary is None:
+                summary = summarize(self.df)
+            df_key = np.zeros(len(self.df), dtype='int64')
+            summary_key = np.zeros(len(summary), dtype='int64')
+            valid = np.ones(len(summary), dtype=bool)
+            for key in [k for k in ['state', 'name', 'gender']
+                        if k in summary.columns]:
+                if key == 'name':
+                    codes = self._name_codes
+                    categories = self._name_categories
+                else:
+                    column = self.df[key]
+                    if not isinstance(column.dtype, pd.CategoricalDtype):
+                        column = column.astype('category')
+                    codes = column.cat.codes.values
+                    categories = column.cat.categories
+                summary_codes = categories.get_indexer(
+                    np.asarray(summary[key], dtype=object)
+                )
+                valid &= summary_codes >= 0
+                df_key = df_key*len(categories)+codes
+                summary_key = summary_key*len(categories)+summary_codes
+            # Summary rows of names not in df never match
+            summary_key[~valid] = -1
+            order = np.argsort(summary_key, kind='stable')
+            sorted_key = summary_key[order]
+            pos = np.searchsorted(sorted_key, df_key)
+            pos = np.minimum(pos, max(len(sorted_key)-1, 0))
+            if len(sorted_key):
+                found = sorted_key[pos] == df_key
+                rows = np.where(found, order[pos], -1)
+            else:
+                rows = np.full(len(df_key), -1, dtype='int64')
+        self._summary_rows = (summary, rows)
+        return self._summary_rows
+
+
+    def _summary_mask(self, first_year_start=None, first_year_end=None,
+                      peak_year_start=None, peak_year_end=None,
+                      total_n_min=None, best_rank_min=None,
+                      worst_rank_max=None):
+        """
+        Description:
+            Row mask of the rows whose summary satisfies the criteria, e.g.,
+            the rows of names first seen in or after first_year_start.
+
+        Returns:
+            boolean array of rows
+        """
+        summary, rows = self._summary_index()
+        keep = np.ones(len(summary)+1, dtype=bool)
+        # Rank 1 is HIGHER than Rank 500, i.e., 1 > 500
+        for column, bound, op in [
+                ('first_year', first_year_start, np.greater_equal),
+                ('first_year', first_year_end, np.less_equal),
+                ('peak_year', peak_year_start, np.greater_equal),
+                ('peak_year', peak_year_end, np.less_equal),
+                ('total_n', total_n_min, np.greater_equal),
+                ('best_rank', best_rank_min, np.greater_equal),
+                ('worst_rank', worst_rank_max, np.less_equal)]:
+            if bound is not None:
+                keep[:-1] &= op(summary[column].values, bound)
+        # Rows without a summary (row -1) are dropped
+        keep[-1] = False
+        return keep[rows]
+
+
+    def _unique_names(self, key):
+        codes = np.unique(self._name_codes[self._rows(key)])
+        names = np.sort(np.asarray(self._name_categories[codes], dtype=object))
+        names.setflags(write=False)
+        return names
+
+
+    def rows(self, **criteria):
+        """
+        Description:
+            Rows of df that satisfy the criteria (see slice_names).
+
+        Returns:
+            read-only array of row positions
+        """
+        return self._rows(self._key(**criteria))
+
+
+    def slice(self, **criteria):
+        """
+        Description:
+            Slices df to the rows that satisfy the criteria (see
+            slice_names).
+
+        Returns:
+            sliced dataframe
+        """
+        return self.df.take(self.rows(**criteria))
+
+
+    def names(self, **criteria):
+        """
+        Description:
+            Distinct names of the rows that satisfy the criteria (see
+            slice_names).
+
+        Returns:
+            read-only sorted array of names
+        """
+        return self._names(self._key(**criteria))
+
+
+    def cache_info(self):
+        return self._rows.cache_info()
+
+
+    def cache_clear(self):
+        self._rows.cache_clear()
+        self._names.cache_clear()
+        return
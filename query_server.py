@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+A local JSON query server of SSA baby name data. The data is loaded once
+and shared by every client, so dashboards and batch jobs skip the load.
+
+    python query_server.py --data-folder data/ --port 8000
+
+Every query is a POST of a JSON object of its arguments to /<query>:
+
+    /slice_names     criteria of slice_names, plus 'source' ('national' or
+                     'state'), 'columns', and 'limit' (rows)
+    /generate_names  criteria of generate_names, plus 'source' and 'n'
+    /history         'names', 'gender' (str, or a list of one per name),
+                     'column' ('n', 'f', or 'rank'), and 'state' (optional)
+    /batch           list of {"query": ..., "args": {...}}, answered with a
+                     list of {"result": ...} or {"error": ...}
+
+GET /health reports if the server is up.
+"""
+
+import json
+import argparse
+import threading
+import http.server
+from functools import partial
+
+import numpy as np
+
+from tables import ssa_tables
+from instrument import span
+from generate_names import slice_names, generate_names
+
+
+class name_server:
+    """
+    Description:
+        The queries of the query server, answered from the tables of a
+        single ssa_tables object. Indexes built lazily are built once, under
+        a lock of their own (so building the state engine does not hold up
+        national queries), and then read by every thread without locking.
+
+    Arguments:
+        data: ssa_tables (or ssa_data) object
+
+    Keyword arguments:
+        warm: build the national query engine and history index up front
+            (boolean)
+    """
+    queries = ['slice_names', 'generate_names', 'history']
+
+    def __init__(self, data, warm=True):
+        self.data = data
+        self._built = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        if warm:
+            self._query('national')
+            self._series(None)
+        return
+
+
+    def _build(self, key, build):
+        # Built indexes are read without taking any lock
+        if key in self._built:
+            return self._built[key]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._built:
+                self._built[key] = build()
+        return self._built[key]
+
+
+    def _query(self, source):
+        if source not in ('national', 'state'):
+            raise ValueError("source must be 'national' or 'state'")
+        return self._build(('query', source),
+                           lambda: getattr(self.data, source+'_query'))
+
+
+    def _series(self, state):
+        if state is None:
+            return self._build(('series', None),
+                               lambda: self.data.national_series)
+        return self._build(('series', state),
+                           lambda: self.data.state_series(state))
+
+
+    def slice_names(self, source='national', columns=None, limit=None,
+                    **criteria):
+        """
+        Description:
+            Rows that satisfy the criteria (see slice_names).
+
+        Returns:
+            dictionary of column to list of values
+        """
+        df = slice_names(self._query(source), **criteria)
+        if df is None:
+            raise ValueError('invalid criteria')
+        df = df.drop(columns=['year'])
+        if columns is not None:
+            df = df[columns]
+        if limit is not None:
+            df = df.iloc[:limit]
+        return {column: df[column].astype(str).tolist()
+                if df[column].dtype == 'category' else df[column].tolist()
+                for column in df.columns}
+
+
+    def generate_names(self, source='national', n=None, **criteria):
+        """
+        Description:
+            Names that satisfy the criteria, or n of them drawn at random
+            (see generate_names).
+
+        Returns:
+            list of names
+        """
+        if 'pout' in criteria:
+            raise ValueError('pout is not supported')
+        query = self._query(source)
+        # The engine caches the slice, so generate_names does not redo it
+        if slice_names(query, **criteria) is None:
+            raise ValueError('invalid criteria')
+        return np.asarray(generate_names(query, n=n, **criteria),
+                          dtype=str).tolist()
+
+
+    def history(self, names, gender, column='f', state=None):
+        """
+        Description:
+            Gap filled histories of names (see name_series.series).
+
+        Returns:
+            dictionary of name to {'years': [...], 'values': [...]} (None
+            if a name is not found), missing years have null values
+        """
+        if isinstance(names, str):
+            names = [names]
+        genders = [gender]*len(names) if isinstance(gender, str) else gender
+        index = self._series(state)
+        histories = {}
+        for name, gender in zip(names, genders):
+            series = index.series(name, gender, column=column)
+            if series is None:
+                histories[name] = None
+                continue
+            histories[name] = {
+                'years': series.index.year.tolist(),
+                'values': [None if np.isnan(v) else float(v)
+                           for v in series.values]
+            }
+        return histories
+
+
+    def answer(self, query, args):
+        """
+        Description:
+            Answers a single query.
+
+        Arguments:
+            query: name of the query (see queries)
+            args: dictionary of the query's arguments
+
+        Returns:
+            result of the query
+        """
+        if query not in self.queries:
+            raise ValueError('unknown query: {}'.format(query))
+        if not isinstance(args, dict):
+            raise ValueError('arguments must be a JSON object')
+        with span('server_query', query=query):
+            return getattr(self, query)(**args)
+
+
+    def batch(self, requests):
+        """
+        Description:
+            Answers a list of queries, an error of one does not fail the
+            others.
+
+        Arguments:
+            requests: list of {'query': ..., 'args': {...}}
+
+        Returns:
+            list of {'result': ...} or {'error': ...}
+        """
+        results = []
+        for request in requests:
+            try:
+                result = self.answer(request['query'], request.get('args', {}))
+                results.append({'result': result})
+            except (KeyError, ValueError, TypeError) as e:
+                results.append({'error': str(e)})
+        return results
+
+
+class _handler(http.server.BaseHTTPRequestHandler):
+    def __init__(self, server_, *args, **kwargs):
+        self.name_server = server_
+        super().__init__(*args, **kwargs)
+
+
+    def log_message(self, *args):
+        pass
+
+
+    def _reply(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        return
+
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/health':
+            return self._reply(404, {'error': 'not found'})
+        return self._reply(200, {'status': 'ok'})
+
+
+    def do_POST(self):
+        query = self.path.strip('/')
+        if query != 'batch' and query not in self.name_server.queries:
+            return self._reply(404, {'error': 'unknown query: {}'.format(
+                query)})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            args = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            return self._reply(400, {'error': 'invalid JSON: {}'.format(e)})
+        try:
+            if query == 'batch':
+                if isinstance(args, dict):
+                    args = args.get('requests', [])
+                return self._reply(200, self.name_server.batch(args))
+            return self._reply(200, self.name_server.answer(query, args))
+        except (KeyError, ValueError, TypeError) as e:
+            return self._reply(400, {'error': str(e)})
+
+
+def serve(data, host='127.0.0.1', port=8000, warm=True):
+    """
+    Description:
+        Makes a query server of data, serving every client in its own
+        thread. Call serve_forever() on it to start serving.
+
+    Arguments:
+        data: ssa_tables (or ssa_data) object
+
+    Keyword arguments:
+        host: address to listen on
+        port: port to listen on (0 for any free port)
+        warm: build the national indexes before serving (boolean)
+
+    Returns:
+        http.server.ThreadingHTTPServer
+    """
+    handler = partial(_handler, name_server(data, warm=warm))
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-folder', default='data/',
+                        help='directory where data is stored')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on')
+    parser.add_argument('--mmap-cache', action='store_true',
+                        help='load tables from memory-mapped Arrow caches')
+    args = parser.parse_args()
+    data = ssa_tables(args.data_folder, mmap_cache=args.mmap_cache)
+    server = serve(data, host=args.host, port=args.port)
+    print('Serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return
+
+
+if __name__ == '__main__':
+    main()
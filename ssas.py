@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
-import io
 import os
 import numpy as np
 import pandas as pd
 from zipfile import ZipFile
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from utils import *
+from utils import _request_content, _download_file
+from instrument import span
+from tables import ssa_tables
+from datastore import (national_schema, state_schema, to_schema, read_table,
+                       summarize, merge_summaries, write_table, table_exists,
+                       national_partitioning, state_partitioning, part_name,
+                       read_manifest, write_manifest, prepare_dataset,
+                       write_part, remove_part, member_summary_path)
 
 
 # Vanity dictionary for converting SSA table headers
@@ -24,53 +30,243 @@ _gender_dict = {
 }
 
 
-class ssa_data:
+def _rank_and_fraction(df, keys, denominator=None):
+    """
+    Description:
+        Computes the fraction ('f') and popularity rank ('rank') of every
+        name within each group of keys in a single group-wise pass.
+
+    Arguments:
+        df: dataframe with an 'n' column
+        keys: columns that define a group (list of str)
+
+    Keyword arguments:
+        denominator: series aligned to df used for the fraction (Default:
+            sum of 'n' within each group)
+
+    Returns:
+        df with 'f' and 'rank' columns assigned
+    """
+    groups = df.groupby(keys, sort=False)['n']
+    if denominator is None:
+        denominator = groups.transform('sum')
+    return df.assign(f=df['n']/denominator,
+                     rank=groups.rank(method='min', ascending=False))
+
+
+def _iter_groups(file_obj, names, keys, chunk_size):
+    """
+    Description:
+        Reads a csv file chunk_size rows at a time, yielding batches of
+        complete groups. A group is a run of consecutive rows sharing the
+        same keys, and rows of a group left incomplete at the end of a
+        chunk are carried over to the next batch.
+
+    Arguments:
+        file_obj: file object of the csv
+        names: names of the csv's columns
+        keys: columns that define a group (list of str)
+        chunk_size: number of rows read at a time
+
+    Returns:
+        generator of dataframes
+    """
+    carry = None
+    reader = pd.read_csv(file_obj, index_col=None, header=0, names=names,
+                         chunksize=chunk_size)
+    while True:
+        # Includes inflating the member's compressed bytes
+        with span('csv_parse'):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+        if carry is not None:
+            with span('concat', rows=len(carry)+len(chunk)):
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+        last = (chunk[keys] == chunk[keys].iloc[-1]).all(axis=1).values
+        if last.all():
+            carry = chunk
+            continue
+        start = len(chunk)-np.argmin(last[::-1])
+        carry = chunk.iloc[start:]
+        yield chunk.iloc[:start]
+    if carry is not None:
+        yield carry
+
+
+def _ingest_member(zip_path, file_, path, digests, chunk_size,
+                   year_totals=None):
+    """
+    Description:
+        Streams a single member of an SSA archive into its dataset. The
+        fraction and rank of every complete (gender, year) group read in a
+        chunk are computed in one group-wise pass, and each group is then
+        written as a part of its partition, unless the digest of the part
+        is unchanged. The member's summary (see datastore.summarize) is
+        built along the way and saved with the dataset.
+
+    Arguments:
+        zip_path: path of the SSA archive
+        file_: name of the member (e.g., 'yob1990.txt' or 'WY.TXT')
+        path: directory of the dataset
+        digests: dictionary of part to digest, of the dataset as is
+        chunk_size: number of rows read at a time
+
+    Keyword arguments:
+        year_totals: dictionary of gender to total births of the member's
+            year, denominator of national fractions (Default: member is a
+            state file, we use the sum of names)
+
+    Returns:
+        dictionary of part to digest of every part of the member
+    """
+    if year_totals is None:
+        names = ['state', 'gender', 'year', 'name', 'n']
+        groups = ['gender', 'year']
+        schema, keys = state_schema, state_partitioning
+    else:
+        names = ['name', 'gender', 'n']
+        groups = ['gender']
+        schema, keys = national_schema, national_partitioning
+    new_digests = {}
+    updated = 0
+    summary = None
+    with span('member', file=file_), ZipFile(zip_path) as archive:
+        with span('zip_read', file=file_):
+            f = archive.open(file_)
+        for df in _iter_groups(f, names, groups, chunk_size):
+            with span('rank_fraction', rows=len(df)):
+                if year_totals is None:
+                    # This is not 100% accurate, but close enough guess as
+                    # we lack total state births (we undercount births)
+                    df = _rank_and_fraction(df, ['gender', 'year'])
+                else:
+                    df = _rank_and_fraction(
+                        df.assign(year=int(file_[3:7])), ['gender'],
+                        denominator=df['gender'].map(year_totals)
+                    )
+            with span('summarize', rows=len(df)):
+                # f as it is stored, so peaks match those read back
+                part_summary = summarize(df.assign(
+                    year_int=df['year'], f=df['f'].astype(schema['f'])
+                ))
+                summary = (part_summary if summary is None
+                           else merge_summaries([summary, part_summary]))
+            for (gender, year), df_part in df.groupby(['gender', 'year'],
+                                                      sort=False):
+                values = [df_part[k].iloc[0] for k in keys[:-1]]+[year]
+                part = part_name(keys, values, 'part-'+gender)
+                digest = '{:016x}'.format(int(pd.util.hash_pandas_object(
+                    df_part[names], index=False
+                ).sum()))
+                if year_totals is not None:
+                    # f depends on the year's totals, so they are in digest
+                    digest += ':{}'.format(year_totals[gender])
+                new_digests[part] = digest
+                if digests.get(part) == digest:
+                    continue
+                updated += 1
+                with span('schema', rows=len(df_part)):
+                    df_part = to_schema(df_part, schema)
+                write_part(df_part, path, part, keys)
+        f.close()
+    if summary is not None:
+        summary_path = member_summary_path(path, file_)
+        os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+        write_table(summary, summary_path)
+    if updated:
+        print('  Updating: {:s} ({:d} parts)'.format(file_, updated))
+    return new_digests
+
+
+class ssa_data(ssa_tables):
     """
     Description:
         A class containing functions for fetching, saving, and loading the
         data on first names provided by the SSA (social security
-        administration). When called returns an object that has all the data
-        loaded into pandas dataframes.
+        administration). When called returns an object whose dataframes are
+        loaded lazily, the first time each attribute is accessed. To only
+        read a data folder that is already built, tables.ssa_tables does
+        the same without the fetching machinery.
     
     Keyword arguements:
         data_folder: directory where data is stored
         total_file: parquest file name of total dataframe
         national_file: parquest file name of national dataframe
         state_file: parquest file name of state dataframe
+        national_summary_file: parquet file name of the national summary
+        state_summary_file: parquet file name of the state summary
+        national_trends_file: file name of the saved national trends
+        state_cube_file: file name of the saved state cube
+        chunk_size: number of rows parsed at a time while ingesting the
+            SSA archives, bounding the memory used
+        ssa_url: base url the SSA files are downloaded from
+        concurrent: fetch the totals, national, and state data in parallel
+            threads when building the data folder, each parsed as soon as
+            it is downloaded (boolean)
+        mmap_cache: load the tables from memory-mapped Arrow caches next
+            to the parquet files, written on first use and rewritten when
+            the parquet data changes (boolean)
         
     Attributes:
-        totals: dataframe of totals
-        national: dataframe of naitonal data
-        state: dataframe of state data
+        see tables.ssa_tables
+
+    Notes:
+        ^Use load_national() and load_state() to read only the columns and
+         rows a job needs, rather than the full tables.
+        ^Failed downloads raise utils.DownloadError.
     """
     def __init__(self, data_folder = 'data/',
                  total_file='birth_totals.parquet',
                  national_file='birth_US_national.parquet',
-                 state_file='birth_US_state.parquet'):
-        self._ssa_url = 'https://www.ssa.gov/oact/babynames/'
+                 state_file='birth_US_state.parquet',
+                 national_summary_file='summary_US_national.parquet',
+                 state_summary_file='summary_US_state.parquet',
+                 national_trends_file='trends_US_national.npz',
+                 state_cube_file='cube_US_state.npz',
+                 chunk_size=2**17,
+                 ssa_url='https://www.ssa.gov/oact/babynames/',
+                 concurrent=False, mmap_cache=False):
+        self._ssa_url = ssa_url
         self._totals_url = self._ssa_url+'numberUSbirths.html'
         self._natioanl_url = self._ssa_url+'names.zip'
         self._state_url = self._ssa_url+'state/namesbystate.zip'
         # check that data_folder exist, if not create it
         if not os.path.exists(data_folder):
             os.makedirs(data_folder, exist_ok=True)
-        # file paths
-        self.total_path = data_folder+total_file
-        self.national_path = data_folder+national_file
-        self.state_path = data_folder+state_file
-        # fetch and set US annual birth totals
+        super().__init__(data_folder, total_file=total_file,
+                         national_file=national_file, state_file=state_file,
+                         national_summary_file=national_summary_file,
+                         state_summary_file=state_summary_file,
+                         national_trends_file=national_trends_file,
+                         state_cube_file=state_cube_file,
+                         mmap_cache=mmap_cache)
+        self.chunk_size = chunk_size
+        if concurrent:
+            # national fractions need the totals, so national waits on them
+            # after its download, while the state data does not wait at all
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                totals = executor.submit(self.fetch_US_birth_totals,
+                                         header_dict=_my_header_dict)
+                futures = [
+                    totals,
+                    executor.submit(self.fetch_US_birth_national,
+                                    wait_for=totals),
+                    executor.submit(self.fetch_US_birth_state)
+                ]
+                for future in futures:
+                    future.result()
+            return
+        # fetch US annual birth totals
         self.fetch_US_birth_totals(header_dict=_my_header_dict)
-        self.totals = pd.read_parquet(self.total_path)
-        # fetch and set US first-name totals at the national level
+        # fetch US first-name totals at the national level
         self.fetch_US_birth_national()
-        self.national = pd.read_parquet(self.national_path)
-        # fetch and set US first-name totals at the state level
+        # fetch US first-name totals at the state level
         self.fetch_US_birth_state()
-        self.state = pd.read_parquet(self.state_path)
         return
-    
 
-    def fetch_US_birth_totals(self, header_dict={}, update=False):
+
+    def fetch_US_birth_totals(self, header_dict=_my_header_dict, update=False):
         """
         Description:
             Scraps the SSA table of total births in US proper (not including
@@ -87,7 +283,13 @@ class ssa_data:
         if not update and os.path.isfile(self.total_path):
             return
         print('Fetching totals by year of US baby names')
-        soup = BeautifulSoup(_request_content(self._totals_url), 'html.parser')
+        content = _request_content(
+            self._totals_url, cache_path=self.data_folder+'numberUSbirths.html'
+        )
+        # bs4 is only imported once there is something to scrape
+        from bs4 import BeautifulSoup
+        with span('html_parse'):
+            soup = BeautifulSoup(content, 'html.parser')
         header = [header_dict.get(h.text.strip(), h.text.strip())
                   for h in soup.find_all('th')]
         data = [[int(td.text.strip().replace(',', ''))
@@ -96,68 +298,200 @@ class ssa_data:
         df = pd.DataFrame(data, columns=header)
         year_str = header_dict.get('Year of birth', 'Year of birth')
         df[year_str] = pd.to_datetime(df[year_str], format='%Y')
+        self.__dict__.pop('totals', None)
         return df.to_parquet(self.total_path)
     
 
-    def fetch_US_birth_national(self, update=False):
+    def _write_summary(self, path, summary_path, keys):
+        """
+        Description:
+            Summarizes a dataset (see datastore.summarize) and saves it as
+            a parquet file, along with the members it is of. The summaries
+            of the members saved while ingesting them are merged, into the
+            saved summary if members were only added since, so the dataset
+            is not read back. A dataset ingested before members were
+            summarized is read back instead, only the columns the summary
+            needs.
+
+        Arguments:
+            path: directory of the dataset
+            summary_path: path of the summary file
+            keys: partition columns of the dataset (list of str)
+
+        Returns:
+            Nothing
+        """
+        print('  Summarizing: {:s}'.format(path))
+        members = read_manifest(path)['members']
+        with span('summary', path=summary_path):
+            summary, source = None, {}
+            if os.path.isfile(summary_path):
+                summary = read_table(summary_path)
+                source = summary.attrs.get('source', {})
+                if not source or any(members.get(file_) != digest
+                                     for file_, digest in source.items()):
+                    summary, source = None, {}
+            paths = [member_summary_path(path, file_) for file_ in members
+                     if file_ not in source]
+            if paths and all(os.path.isfile(p) for p in paths):
+                # A few members at a time, bounding the memory used
+                for start in range(0, len(paths), 16):
+                    batch = [read_table(p) for p in paths[start:start+16]]
+                    if summary is not None:
+                        batch.insert(0, summary)
+                    summary = merge_summaries(batch)
+            elif paths or summary is None:
+                columns = [k for k in keys if k != 'year_int']
+                columns += ['name', 'gender', 'year_int', 'n', 'f', 'rank']
+                summary = summarize(read_table(path, columns=columns))
+            summary.attrs['source'] = members
+            write_table(summary, summary_path)
+        return
+
+
+    def _ingest_archive(self, zip_path, path, members, keys, summary_path,
+                        processes=None):
+        """
+        Description:
+            Streams the data members of an SSA archive into a dataset. Only
+            the members whose digest changed since the manifest was written
+            are read, and parts no longer in the archive are removed. The
+            summary of the dataset is then updated if anything changed.
+
+        Arguments:
+            zip_path: path of the SSA archive
+            path: directory of the dataset
+            members: dictionary of data member to (digest, year_totals),
+                see _ingest_member for year_totals
+            keys: partition columns (list of str)
+            summary_path: path of the dataset's summary file
+
+        Keyword arguments:
+            processes: number of worker processes used to ingest members
+                concurrently (Default: ingest serially)
+
+        Returns:
+            Nothing
+        """
+        prepare_dataset(path)
+        manifest = read_manifest(path)
+        changed = [file_ for file_, (digest, _) in members.items()
+                   if manifest['members'].get(file_) != digest]
+        # Keep the parts of unchanged members as they are
+        parts = {part: entry for part, entry in manifest['parts'].items()
+                 if entry['member'] in members
+                 and entry['member'] not in changed}
+        args = [(zip_path, file_, path,
+                 {part: entry['digest']
+                  for part, entry in manifest['parts'].items()
+                  if entry['member'] == file_},
+                 self.chunk_size, members[file_][1])
+                for file_ in changed]
+        with span('ingest', path=path, members=len(changed)):
+            if processes is not None and processes > 1:
+                with ProcessPoolExecutor(max_workers=processes) as executor:
+                    results = list(executor.map(_ingest_member, *zip(*args)))
+            else:
+                results = [_ingest_member(*arg) for arg in args]
+        for file_, digests in zip(changed, results):
+            parts.update({part: {'member': file_, 'digest': digest}
+                          for part, digest in digests.items()})
+        for part in set(manifest['parts'])-set(parts):
+            remove_part(path, part)
+        for file_ in set(manifest['members'])-set(members):
+            if os.path.isfile(member_summary_path(path, file_)):
+                os.remove(member_summary_path(path, file_))
+        write_manifest(path, {'partitioning': keys, 'parts': parts,
+                              'members': {file_: digest for file_, (digest, _)
+                                          in members.items()}})
+        if changed or not os.path.isfile(summary_path):
+            self._write_summary(path, summary_path, keys)
+        return
+
+
+    def fetch_US_birth_national(self, update=False, processes=None,
+                                wait_for=None):
         """
         Description:
             Downloads the data from the SSA about first name assigned at
             birth in US proper (not including territories). Saves the data
-            to a parquet file. Contains the number of occurances (n),
-            fraction of that gender ('f'), popularity rank ('rank') for each
-            name broken down by year and gender.
+            to a parquet dataset partitioned by year. Contains the number of
+            occurances (n), fraction of that gender ('f'), popularity rank
+            ('rank') for each name broken down by year and gender. Columns
+            are stored with the compact dtypes of datastore.national_schema.
+            The archive is downloaded to data_folder and streamed into the
+            dataset chunk_size rows at a time.
             
         Keyword arguments:
-            update: if we should update data even if it exist (boolean)
+            update: if we should update data even if it exist, only the
+                years that are missing or changed are rebuilt (boolean)
+            processes: number of worker processes used to parse the year
+                files concurrently (Default: parse serially)
+            wait_for: future to wait on after downloading and before the
+                totals are read, e.g., of a concurrent fetch of the totals
             
         Returns:
-            Nothing (but saves dataframe parquet file in data/ by default)
+            Nothing (but saves parquet dataset in data/ by default)
         """
-        if not update and os.path.isfile(self.national_path):
+        if not update and table_exists(self.national_path):
+            # Data folders saved before summaries were added lack them
+            if not os.path.exists(self.national_summary_path):
+                self._write_summary(self.national_path,
+                                    self.national_summary_path,
+                                    national_partitioning)
             return
         print('Fetching national level data of US baby names')
-        buffer = io.BytesIO(_request_content(self._natioanl_url))
-        files_ = ZipFile(buffer).namelist()
-        data = []
-        for file_ in files_:
-            if file_[0:3] == 'yob' and file_[-4:] == '.txt': 
-                year = file_[3:7]
-                year_totals = self.totals.loc[self.totals['year']==year]
-                df = pd.read_csv(io.BytesIO(ZipFile(buffer).read(file_)),
-                                 index_col=None, header=0,
-                                 names=['name', 'gender', 'n']
-                                ).assign(year=year)
-                for gender in ['M', 'F']:
-                    df_gender = df.loc[df['gender']==gender]
-                    yearly_total = year_totals[_gender_dict[gender]].values[0]
-                    df_gender = df_gender.assign(
-                        f = df_gender['n']/yearly_total,
-                        rank = df_gender['n'].rank(method='min',
-                                                   ascending=False)
-                    )
-                    data.append(df_gender)
-            else:
-                print('  Extracting: {:s}'.format(file_))
-                ZipFile(buffer).extract(file_, path='data/') 
-        data_stack = np.vstack(data)
-        df = pd.DataFrame(data_stack,
-                          columns=['name', 'gender', 'n', 'year', 'f', 'rank'])
-        df['year'] = pd.to_datetime(df['year'], format='%Y')
-        return df.to_parquet(self.national_path)
+        zip_path = _download_file(self._natioanl_url,
+                                  self.data_folder+'names.zip')
+        if wait_for is not None:
+            wait_for.result()
+        members = {}
+        with span('zip_read', file=zip_path), ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                file_ = info.filename
+                if file_[0:3] == 'yob' and file_[-4:] == '.txt':
+                    year_totals = self.totals.loc[
+                        self.totals['year']==file_[3:7]
+                    ]
+                    year_totals = {
+                        gender: int(year_totals[column].values[0])
+                        for gender, column in _gender_dict.items()
+                    }
+                    members[file_] = ('{:08x}:{}:{}'.format(
+                        info.CRC, year_totals['M'], year_totals['F']
+                    ), year_totals)
+                else:
+                    print('  Extracting: {:s}'.format(file_))
+                    archive.extract(file_, path=self.data_folder)
+        self._ingest_archive(zip_path, self.national_path, members,
+                             national_partitioning,
+                             self.national_summary_path, processes=processes)
+        self.__dict__.pop('national', None)
+        self.__dict__.pop('national_summary', None)
+        self.__dict__.pop('national_query', None)
+        self.__dict__.pop('national_series', None)
+        self.__dict__.pop('national_trends', None)
+        return
 
 
-    def fetch_US_birth_state(self, update=False):
+    def fetch_US_birth_state(self, update=False, processes=None):
         """
         Description:
             Downloads the data from the SSA about first name assigned at
             birth in US proper (not including territories). Saves the data
-            to a parquet file. Contains the number of occurances (n),
-            fraction of that gender ('f'), popularity rank ('rank') for each
-            name broken down by year, gender, and state.
+            to a parquet dataset partitioned by state and year. Contains the
+            number of occurances (n), fraction of that gender ('f'),
+            popularity rank ('rank') for each name broken down by year,
+            gender, and state. Columns are stored with the compact dtypes of
+            datastore.state_schema. The archive is downloaded to data_folder
+            and streamed into the dataset chunk_size rows at a time.
             
         Keyword arguments:
-            update: if we should update data even if it exist (boolean)
+            update: if we should update data even if it exist, only the
+                states and years that are missing or changed are rebuilt
+                (boolean)
+            processes: number of worker processes used to parse the state
+                files concurrently (Default: parse serially)
             
         Notes:
             ^The fraction ('f') is not 100% accurate as it does not use the
@@ -175,39 +509,32 @@ class ssa_data:
              girls have more unquie names and thus are more unaccounted for.
             
         Returns:
-            Nothing (but saves dataframe parquet file in data/ by default)
+            Nothing (but saves parquet dataset in data/ by default)
         """
-        if not update and os.path.isfile(self.state_path):
+        if not update and table_exists(self.state_path):
+            if not os.path.exists(self.state_summary_path):
+                self._write_summary(self.state_path, self.state_summary_path,
+                                    state_partitioning)
             return
         print('Fetching state level data of US baby names')
-        buffer = io.BytesIO(_request_content(self._state_url))
-        files_ = ZipFile(buffer).namelist()
-        data = []
-        for file_ in files_:
-            if len(file_) == 6 and file_[-4:] == '.TXT': 
-                state = file_[0:2]
-                df = pd.read_csv(io.BytesIO(ZipFile(buffer).read(file_)),
-                                 index_col=None, header=0,
-                                 names=['state', 'gender', 'year', 'name', 'n'])
-                for gender in ['M', 'F']:
-                    for year in df['year'].unique():
-                        df_gender_year = df.loc[(df['gender']==gender) &
-                                                (df['year']==year)]
-                        # This is not 100% accurate, but close enough guess as
-                        # we lack total state births (we undercount births)
-                        gender_year_total = df_gender_year['n'].sum()
-                        df_gender_year = df_gender_year.assign(
-                            f = df_gender_year['n']/gender_year_total,
-                            rank = (df_gender_year['n'].rank(method='min',
-                                                             ascending=False))
-                        )
-                        data.append(df_gender_year)
-            else:
-                print('  Extracting: {:s}'.format(file_))
-                ZipFile(buffer).extract(file_, path='data/') 
-        data_stack = np.vstack(data)
-        df = pd.DataFrame(data_stack,
-                          columns=['state', 'gender', 'year',
-                                   'name', 'n', 'f', 'rank'])
-        df['year'] = pd.to_datetime(df['year'], format='%Y')
-        return df.to_parquet(self.state_path)
\ No newline at end of file
+        zip_path = _download_file(self._state_url,
+                                  self.data_folder+'namesbystate.zip')
+        members = {}
+        with span('zip_read', file=zip_path), ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                file_ = info.filename
+                if len(file_) == 6 and file_[-4:] == '.TXT':
+                    members[file_] = ('{:08x}'.format(info.CRC), None)
+                else:
+                    print('  Extracting: {:s}'.format(file_))
+                    archive.extract(file_, path=self.data_folder)
+        self._ingest_archive(zip_path, self.state_path, members,
+                             state_partitioning, self.state_summary_path,
+                             processes=processes)
+        self.__dict__.pop('state', None)
+        self.__dict__.pop('state_summary', None)
+        self.__dict__.pop('state_cube', None)
+        self.__dict__.pop('state_query', None)
+        self._state_series = {}
+        self._state_trends = {}
+        return
\ No newline at end of file
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import os
+from functools import cached_property
+
+from query import name_query
+from timeseries import name_series
+from trends import name_trends
+from cube import state_cube
+from datastore import read_table, read_cached, read_manifest
+
+
+class ssa_tables:
+    """
+    Description:
+        Read-only access to a data folder built by ssa_data, without any
+        of the machinery fetching the data (and its dependencies). The
+        dataframes are loaded lazily, the first time each attribute is
+        accessed. ssa_data extends it with fetching.
+
+    Keyword arguments:
+        data_folder: directory where data is stored
+        total_file: parquet file name of total dataframe
+        national_file: parquet file name of national dataframe
+        state_file: parquet file name of state dataframe
+        national_summary_file: parquet file name of the national summary
+        state_summary_file: parquet file name of the state summary
+        national_trends_file: file name of the saved national trends
+        state_cube_file: file name of the saved state cube
+        mmap_cache: load the tables from memory-mapped Arrow caches next
+            to the parquet files, written on first use and rewritten when
+            the parquet data changes (boolean)
+
+    Attributes:
+        totals: dataframe of totals
+        national: dataframe of naitonal data
+        state: dataframe of state data
+        national_summary: dataframe of the history of every name and gender
+            in the national data, see datastore.summarize
+        state_summary: dataframe of the history of every name and gender
+            in every state
+        national_query: name_query engine of the national data
+        state_query: name_query engine of the state data
+        national_series: name_series index of the national data
+        national_trends: name_trends of the national data, saved and
+            updated for only the new or changed years after a fetch
+        state_cube: state_cube of the state data, saved and rebuilt only
+            after a fetch changed the state data
+
+    Notes:
+        ^Use load_national() and load_state() to read only the columns and
+         rows a job needs, rather than the full tables.
+        ^Raises FileNotFoundError if data_folder does not exist, tables
+         missing from it raise when they are accessed.
+        ^The saved trends, cube, and Arrow caches are written to data_folder
+         when missing or stale. If data_folder is read-only (e.g., a shared
+         mount), they are computed in memory instead.
+    """
+    def __init__(self, data_folder='data/',
+                 total_file='birth_totals.parquet',
+                 national_file='birth_US_national.parquet',
+                 state_file='birth_US_state.parquet',
+                 national_summary_file='summary_US_national.parquet',
+                 state_summary_file='summary_US_state.parquet',
+                 national_trends_file='trends_US_national.npz',
+                 state_cube_file='cube_US_state.npz', mmap_cache=False):
+        if not os.path.isdir(data_folder):
+            raise FileNotFoundError('No data folder: {}'.format(data_folder))
+        # file paths
+        self.data_folder = data_folder
+        self.mmap_cache = mmap_cache
+        self._state_series = {}
+        self._state_trends = {}
+        self.total_path = data_folder+total_file
+        self.national_path = data_folder+national_file
+        self.state_path = data_folder+state_file
+        self.national_summary_path = data_folder+national_summary_file
+        self.state_summary_path = data_folder+state_summary_file
+        self.national_trends_path = data_folder+national_trends_file
+        self.state_cube_path = data_folder+state_cube_file
+        return
+
+
+    def _read(self, path):
+        return read_cached(path) if self.mmap_cache else read_table(path)
+
+
+    @cached_property
+    def totals(self):
+        return self._read(self.total_path)
+
+
+    @cached_property
+    def national(self):
+        return self._read(self.national_path)
+
+
+    @cached_property
+    def state(self):
+        return self._read(self.state_path)
+
+
+    @cached_property
+    def national_summary(self):
+        return self._read(self.national_summary_path)
+
+
+    @cached_property
+    def state_summary(self):
+        return self._read(self.state_summary_path)
+
+
+    @cached_property
+    def national_query(self):
+        return name_query(self.national, summary=self.national_summary)
+
+
+    @cached_property
+    def state_query(self):
+        return name_query(self.state, summary=self.state_summary)
+
+
+    @cached_property
+    def national_series(self):
+        return name_series(self.national)
+
+
+    @cached_property
+    def national_trends(self):
+        # Saved trends know the digest of every year file they are of
+        members = read_manifest(self.national_path)['members']
+        trends = None
+        if os.path.isfile(self.national_trends_path):
+            trends = name_trends.load(self.national_trends_path)
+            if trends.source == members:
+                return trends
+            changed = [int(file_[3:7]) for file_, digest in members.items()
+                       if trends.source.get(file_) != digest]
+            if set(trends.source)-set(members) or not changed:
+                trends = None
+        if trends is None:
+            trends = name_trends(self.national_series)
+        else:
+            trends = trends.update(self.national_series, since=min(changed))
+        trends.source = members
+        try:
+            trends.save(self.national_trends_path)
+        except OSError:
+            # e.g., a read-only data folder, the trends are only in memory
+            pass
+        return trends
+
+
+    @cached_property
+    def state_cube(self):
+        members = read_manifest(self.state_path)['members']
+        if os.path.isfile(self.state_cube_path):
+            cube = state_cube.load(self.state_cube_path)
+            if cube.source == members:
+                return cube
+        if 'state' in self.__dict__:
+            df = self.state
+        else:
+            df = self.load_state(columns=['state', 'gender', 'year_int',
+                                          'name', 'n', 'f'])
+        cube = state_cube(df)
+        cube.source = members
+        try:
+            cube.save(self.state_cube_path)
+        except OSError:
+            # e.g., a read-only data folder, the cube is only in memory
+            pass
+        return cube
+
+
+    def state_trends(self, state):
+        """
+        Description:
+            Trends of a single state's names (computed once per state, then
+            cached).
+
+        Arguments:
+            state: state abbreviation (e.g., 'WY')
+
+        Returns:
+            name_trends of the state
+        """
+        if state not in self._state_trends:
+            self._state_trends[state] = name_trends(self.state_series(state))
+        return self._state_trends[state]
+
+
+    def state_series(self, state):
+        """
+        Description:
+            Dense name by year index of a single state's data (built once
+            per state, then cached).
+
+        Arguments:
+            state: state abbreviation (e.g., 'WY')
+
+        Returns:
+            name_series of the state
+        """
+        if state not in self._state_series:
+            if 'state' in self.__dict__:
+                df = self.state[self.state['state']==state]
+            else:
+                df = self.load_state(states=state)
+            self._state_series[state] = name_series(df)
+        return self._state_series[state]
+
+
+    def load_national(self, columns=None, year_start=None, year_end=None,
+                      gender=None, names=None):
+        """
+        Description:
+            Reads the national data, passing the column selection and row
+            filters down to the parquet reader. Does not cache the result.
+
+        Keyword arguments:
+            columns: columns to read (Default: all columns)
+            year_start: first year to read
+            year_end: last year to read
+            gender: gender to read (str or list of str)
+            names: names to read (str or list of str)
+
+        Returns:
+            dataframe of the matching national data
+        """
+        return read_table(self.national_path, columns=columns,
+                          year_start=year_start, year_end=year_end,
+                          gender=gender, names=names)
+
+
+    def load_state(self, columns=None, year_start=None, year_end=None,
+                   gender=None, states=None, names=None):
+        """
+        Description:
+            Reads the state data, passing the column selection and row
+            filters down to the parquet reader. Does not cache the result.
+
+        Keyword arguments:
+            columns: columns to read (Default: all columns)
+            year_start: first year to read
+            year_end: last year to read
+            gender: gender to read (str or list of str)
+            states: states to read (str or list of str)
+            names: names to read (str or list of str)
+
+        Returns:
+            dataframe of the matching state data
+        """
+        return read_table(self.state_path, columns=columns,
+                          year_start=year_start, year_end=year_end,
+                          gender=gender, states=states, names=names)
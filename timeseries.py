@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+from datastore import year_timestamps
+
+
+class name_series:
+    """
+    Description:
+        A dense, year-aligned index of SSA baby name data. Every (name,
+        gender) pair is given a row and every year a column, so the gap
+        filled history of a name is a single row lookup, and the histories
+        of many names a single fancy index.
+
+    Arguments:
+        df: pandas dataframe of SSA baby name data (national data, or the
+            data of a single state, raises ValueError if of several states)
+
+    Keyword arguments:
+        columns: columns to index (list of str)
+
+    Attributes:
+        keys: dataframe of the 'name' and 'gender' of every row
+        years: array of the years of every column
+        timestamps: array of the years as timestamps
+        first: array of the first column observed for every row
+        last: array of the last column observed for every row
+        arrays: dictionary of column to 2D float32 array, NaN where a name
+            was not observed
+    """
+    def __init__(self, df, columns=('n', 'f', 'rank')):
+        # A (name, gender) pair has a single value per year
+        if 'state' in df.columns and df['state'].nunique() > 1:
+            raise ValueError('name_series of more than one state')
+        if 'year_int' in df.columns:
+            years = df['year_int'].values.astype('int64')
+        else:
+            years = df['year'].dt.year.values.astype('int64')
+        groups = df.groupby(['name', 'gender'], observed=True, sort=True)
+        rows = groups.ngroup().values
+        self.keys = groups.size().index.to_frame(index=False)[['name',
+                                                               'gender']]
+        self._rows = {key: row for row, key in
+                      enumerate(zip(self.keys['name'].astype(str),
+                                    self.keys['gender'].astype(str)))}
+        year_min = years.min() if len(years) else 0
+        self.years = np.arange(year_min, years.max()+1 if len(years) else 0)
+        self.timestamps = year_timestamps(self.years)
+        cols = years-year_min
+        self.first = np.full(len(self.keys), len(self.years), dtype='int64')
+        np.minimum.at(self.first, rows, cols)
+        self.last = np.full(len(self.keys), -1, dtype='int64')
+        np.maximum.at(self.last, rows, cols)
+        self.arrays = {}
+        for column in columns:
+            array = np.full((len(self.keys), len(self.years)), np.nan,
+                            dtype='float32')
+            array[rows, cols] = df[column].values
+            self.arrays[column] = array
+        return
+
+
+    def row(self, name, gender):
+        """
+        Description:
+            Row of a name in the index.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Returns:
+            row (int), or None if the name is not in the index
+        """
+        return self._rows.get((name, gender))
+
+
+    def series(self, name, gender, column='f'):
+        """
+        Description:
+            Gap filled history of a single name, from the first to the
+            last year the name was observed. Missing years are NaN.
+
+        Arguments:
+            name: name to look up
+            gender: gender of the name
+
+        Keyword arguments:
+            column: column of the history (e.g., 'n', 'f', or 'rank')
+
+        Returns:
+            pandas series indexed by year timestamps (None if not found)
+        """
+        row = self.row(name, gender)
+        if row is None:
+            return None
+        cols = slice(self.first[row], self.last[row]+1)
+        return pd.Series(self.arrays[column][row, cols],
+                         index=self.timestamps[cols], name=name)
+
+
+    def batch(self, names, genders, column='f'):
+        """
+        Description:
+            Histories of many names at once, over every year of the index.
+
+        Arguments:
+            names: names to look up
+            genders: gender of each name (if str, assumes single gender)
+
+        Keyword arguments:
+            column: column of the histories (e.g., 'n', 'f', or 'rank')
+
+        Returns:
+            2D float32 array, a row per name (all NaN if not found)
+        """
+        if isinstance(genders, str):
+            genders = [genders]*len(names)
+        rows = np.array([self._rows.get(key, -1)
+                         for key in zip(names, genders)], dtype='int64')
+        array = self.arrays[column][rows]
+        array[rows < 0] = np.nan
+        return array
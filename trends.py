@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+import pandas as pd
+
+from instrument import span
+from datastore import atomic_path
+
+
+def _measures(f, rank, start, window, threshold, min_f):
+    """
+    Description:
+        Trend measures of every row, for the columns from start on. Only
+        the window of columns before start is read, so the measures of
+        appended years cost only the appended columns.
+
+    Arguments:
+        f: 2D array of fractions, NaN where a name was not observed
+        rank: 2D array of ranks, NaN where a name was not observed
+        start: first column to compute
+        window, threshold, min_f: see name_trends
+
+    Returns:
+        dictionary of measure to 2D array of the columns from start on
+    """
+    lo = max(start-window, 0)
+    f = f[:, lo:].astype('float64')
+    rank = rank[:, lo:].astype('float64')
+    rows, cols = f.shape
+    rank_change = np.full((rows, cols), np.nan)
+    growth = np.full((rows, cols), np.nan)
+    mean = np.full((rows, cols), np.nan)
+    var = np.full((rows, cols), np.nan)
+    # Rank 1 is HIGHER than Rank 500, so a rising name has a positive change
+    rank_change[:, 1:] = rank[:, :-1]-rank[:, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[:, window:] = np.log(f[:, window:]/f[:, :-window])/window
+    # Years a name was not observed count as (nearly) no births in the
+    # baseline, which is the mean of the window of years before each year
+    f0 = np.nan_to_num(f)
+    sums = np.zeros((rows, cols+1))
+    np.cumsum(f0, axis=1, out=sums[:, 1:])
+    squares = np.zeros((rows, cols+1))
+    np.cumsum(f0*f0, axis=1, out=squares[:, 1:])
+    mean[:, window:] = (sums[:, window:-1]-sums[:, :-window-1])/window
+    var[:, window:] = (squares[:, window:-1]-squares[:, :-window-1])/window
+    std = np.sqrt(np.maximum(var-mean*mean, 0))
+    zscore = (f0-mean)/np.maximum(std, min_f)
+    offset = start-lo
+    return {
+        'rank_change': rank_change[:, offset:].astype('float32'),
+        'growth': growth[:, offset:].astype('float32'),
+        'zscore': zscore[:, offset:].astype('float32'),
+        'breakout': np.nan_to_num(zscore[:, offset:]) >= threshold
+    }
+
+
+class name_trends:
+    """
+    Description:
+        How fast every name is rising or falling, computed for every
+        (name, gender) pair and year at once from a name_series: the year
+        over year rank change, the rolling growth of the fraction, and
+        breakouts, years a name's fraction jumps well above its baseline.
+
+    Arguments:
+        series: name_series with 'f' and 'rank' columns (national data, or
+            the data of a single state)
+
+    Keyword arguments:
+        window: number of years of the rolling growth, and of the baseline
+            a year is compared to for breakouts
+        threshold: z-score over the baseline of a breakout
+        min_f: floor of the baseline's standard deviation, so names with a
+            flat history do not break out on noise
+
+    Attributes:
+        keys: dataframe of the 'name' and 'gender' of every row
+        years: array of the years of every column
+        rank_change: 2D float32 array, ranks gained over the year before
+            (positive if rising)
+        growth: 2D float32 array, mean annual log growth of the fraction
+            over the window
+        zscore: 2D float32 array, fraction over the mean of the window of
+            years before, in standard deviations of that window
+        breakout: 2D boolean array, if zscore is at least the threshold
+        source: dictionary describing the data the trends are of (saved
+            along with them)
+
+    Notes:
+        ^Measures needing years before the first year of the data are NaN.
+    """
+    measures = ['rank_change', 'growth', 'zscore', 'breakout']
+
+    def __init__(self, series, window=5, threshold=3.0, min_f=1e-5):
+        self.window = window
+        self.threshold = threshold
+        self.min_f = min_f
+        self.keys = series.keys
+        self.years = series.years
+        self.source = {}
+        with span('trends', rows=len(self.keys), years=len(self.years)):
+            measures = _measures(series.arrays['f'], series.arrays['rank'], 0,
+                                 window, threshold, min_f)
+        for measure in self.measures:
+            setattr(self, measure, measures[measure])
+        return
+
+
+    def _params(self):
+        return dict(window=self.window, threshold=self.threshold,
+                    min_f=self.min_f)
+
+
+    def update(self, series, since=None):
+        """
+        Description:
+            Trends of a newer name_series of the same data, with years
+            appended (or revised from year since on). The measures of the
+            years before since are kept, and only the years from since on
+            are computed.
+
+        Arguments:
+            series: the newer name_series
+
+        Keyword arguments:
+            since: first year that is new or changed (Default: the year
+                after the last year of these trends)
+
+        Returns:
+            name_trends of series
+        """
+        if since is None:
+            since = self.years[-1]+1 if len(self.years) else None
+        if (since is None or len(series.years) < len(self.years)
+            or series.years[0] != self.years[0] or since <= self.years[0]):
+            return name_trends(series, **self._params())
+        start = int(min(since-self.years[0], len(self.years)))
+        new = name_trends.__new__(name_trends)
+        new.__dict__.update(self._params())
+        new.keys = series.keys
+        new.years = series.years
+        new.source = {}
+        f = series.arrays['f']
+        rank = series.arrays['rank']
+        # Row of every name in these trends, -1 for names new to series
+        rows = pd.MultiIndex.from_frame(self.keys.astype(str)).get_indexer(
+            pd.MultiIndex.from_frame(series.keys.astype(str))
+        )
+        old = rows >= 0
+        with span('trends', rows=len(new.keys), years=len(new.years)-start):
+            measures = _measures(f, rank, start, **self._params())
+            if not old.all():
+                first = _measures(f[~old], rank[~old], 0, **self._params())
+        for measure in self.measures:
+            array = np.empty((len(new.keys), len(new.years)),
+                             dtype=measures[measure].dtype)
+            array[:, start:] = measures[measure]
+            array[old, :start] = getattr(self, measure)[rows[old], :start]
+            if not old.all():
+                array[~old, :start] = first[measure][:, :start]
+            setattr(new, measure, array)
+        return new
+
+
+    def top(self, measure='rank_change', year=None, n=10, gender=None,
+            ascending=False):
+        """
+        Description:
+            Names with the largest (or smallest) measure in a year, e.g.,
+            the fastest risers of the last year.
+
+        Keyword arguments:
+            measure: measure to order by (see measures)
+            year: year to order by (Default: last year)
+            n: number of names
+            gender: gender to restrict results to
+            ascending: smallest first, e.g., the fastest fallers (boolean)
+
+        Returns:
+            dataframe of 'name', 'gender', and the measure (raises
+            ValueError if year is not in years)
+        """
+        if year is None:
+            year = self.years[-1] if len(self.years) else None
+        if year is None or not self.years[0] <= year <= self.years[-1]:
+            raise ValueError('No trends of year {}'.format(year))
+        col = year-self.years[0]
+        df = self.keys.assign(**{measure: getattr(self, measure)[:, col]})
+        if gender is not None:
+            df = df[df['gender']==gender]
+        df = df.dropna(subset=[measure])
+        df = df.sort_values(measure, ascending=ascending, kind='stable')
+        return df.head(n).reset_index(drop=True)
+
+
+    def save(self, path):
+        """
+        Description:
+            Atomically saves the trends (and their source) as a .npz file.
+
+        Arguments:
+            path: path of the file
+
+        Returns:
+            Nothing
+        """
+        with atomic_path(path) as tmp, open(tmp, 'wb') as f:
+            np.savez(f, names=np.asarray(self.keys['name'], dtype=str),
+                     genders=np.asarray(self.keys['gender'], dtype=str),
+                     years=self.years,
+                     params=json.dumps(self._params()),
+                     source=json.dumps(self.source),
+                     **{m: getattr(self, m) for m in self.measures})
+        return
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Description:
+            Loads trends saved with save.
+
+        Arguments:
+            path: path of the file
+
+        Returns:
+            name_trends
+        """
+        trends = cls.__new__(cls)
+        with np.load(path) as npz:
+            trends.__dict__.update(json.loads(str(npz['params'])))
+            trends.source = json.loads(str(npz['source']))
+            trends.keys = pd.DataFrame({
+                'name': pd.Categorical(npz['names']),
+                'gender': pd.Categorical(npz['genders'], categories=['F', 'M'])
+            })
+            trends.years = npz['years']
+            for measure in cls.measures:
+                setattr(trends, measure, npz[measure])
+        return trends
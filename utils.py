@@ -1,41 +1,221 @@
 #!/usr/bin/env python3
 
+import os
+import json
 import time
-import random
-import requests
 import textwrap
 
+from instrument import span
 
-def _request_content(url, **kwargs):
+
+class DownloadError(Exception):
+    """
+    Description:
+        Raised when a url could not be downloaded, either because the
+        server refused the request or because every retry failed.
+    """
+    pass
+
+
+# HTTP statuses worth retrying, anything else is final
+_retry_status = {429, 500, 502, 503, 504}
+
+_session = None
+
+
+def _get_session(pool_size=4):
+    """
+    Description:
+        Shared requests session, so connections to the SSA are pooled and
+        reused across requests (and threads).
+
+    Keyword argument:
+        pool_size: number of connections kept open per host
+
+    Returns:
+        requests.Session
+    """
+    # requests is only imported once something is downloaded
+    import requests
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def _read_json(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _validators(response):
+    """
+    Description:
+        Cache validators of a response (ETag and Last-Modified headers).
+    """
+    return {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')}
+
+
+def _request_content(url, cache_path=None, retries=3, backoff=0.5,
+                     timeout=60, session=None):
     """
     Description:
         Given a url, we will perform a request using the requests library.
-        This handles error catching and sleeps to avoid spamming, in hopes
-        of avoiding being blocked from future request.
-        
+        Failed requests (connection errors, 429 and 5xx statuses) are
+        retried with exponential backoff.
+
     Arguement:
         url: url to perform a request on
-        
+
     Keyword argument:
-        kwargs: keyword arguments passed to request.get()
-        
+        cache_path: cache the content on disk at this path, only fetching
+            it again if the server reports it changed (see _download_file)
+        retries: number of times a failed request is retried
+        backoff: seconds slept before the first retry, doubling after each
+        timeout: seconds to wait on the server before giving up
+        session: requests session to use (Default: shared pooled session)
+
     Notes:
-        ^Sleep [0.5, 1) seconds after a request to avoid spamming server
-        
+        ^Raises DownloadError if the request failed
+
     Returns:
         A response's content
     """
-    try:
-        response = requests.get(url, **kwargs)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as error:
-        raise SystemExit(error)
-    except requests.exceptions.RequestException as error:
-        raise SystemExit(error)
-    print('[HTTP STATUS:{}] {} (elapsed={})'
-          .format(response.status_code, url, response.elapsed))
-    time.sleep(0.5*(1+random.random()))
-    return response.content
+    if cache_path is not None:
+        path = _download_file(url, cache_path, retries=retries,
+                              backoff=backoff, timeout=timeout,
+                              session=session)
+        with open(path, 'rb') as f:
+            return f.read()
+    with span('download', url=url):
+        return _get_content(url, retries, backoff, timeout, session)
+
+
+def _get_content(url, retries, backoff, timeout, session):
+    import requests
+    session = _get_session() if session is None else session
+    error = None
+    for attempt in range(retries+1):
+        if attempt:
+            time.sleep(backoff*2**(attempt-1))
+        try:
+            response = session.get(url, timeout=timeout)
+            if response.status_code in _retry_status:
+                error = 'HTTP status {}'.format(response.status_code)
+                continue
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as http_error:
+            raise DownloadError('{}: {}'.format(url, http_error))
+        except requests.exceptions.RequestException as request_error:
+            error = request_error
+            continue
+        print('[HTTP STATUS:{}] {} (elapsed={})'
+              .format(response.status_code, url, response.elapsed))
+        return response.content
+    raise DownloadError('{}: failed after {} attempts ({})'
+                        .format(url, retries+1, error))
+
+
+def _download_file(url, path, retries=3, backoff=0.5, timeout=60,
+                   chunk_size=2**20, session=None):
+    """
+    Description:
+        Given a url, streams the response's content to a file on disk,
+        never holding more than a chunk of it in memory. The ETag and
+        Last-Modified headers are saved next to the file, so the next
+        download is a conditional request and an unchanged file is not
+        downloaded again. Interrupted downloads are resumed from where
+        they stopped. The file only appears at path once complete.
+
+    Arguements:
+        url: url to perform a request on
+        path: path of the downloaded file
+
+    Keyword argument:
+        retries: number of times a failed request is retried
+        backoff: seconds slept before the first retry, doubling after each
+        timeout: seconds to wait on the server before giving up
+        chunk_size: bytes written to disk at a time
+        session: requests session to use (Default: shared pooled session)
+
+    Notes:
+        ^Raises DownloadError if the download failed
+
+    Returns:
+        path of the downloaded file
+    """
+    with span('download', url=url, path=path):
+        return _get_file(url, path, retries, backoff, timeout, chunk_size,
+                         session)
+
+
+def _get_file(url, path, retries, backoff, timeout, chunk_size, session):
+    import requests
+    session = _get_session() if session is None else session
+    part = path+'.part'
+    error = None
+    for attempt in range(retries+1):
+        if attempt:
+            time.sleep(backoff*2**(attempt-1))
+        headers = {}
+        cached = _read_json(path+'.json')
+        if os.path.isfile(path) and cached.get('url') == url:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        # Resume a partial download, if it is still the same file
+        partial = _read_json(part+'.json')
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        validator = partial.get('etag') or partial.get('last_modified')
+        if offset and partial.get('url') == url and validator:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+        else:
+            offset = 0
+        try:
+            with session.get(url, headers=headers, stream=True,
+                             timeout=timeout) as response:
+                if response.status_code == 304:
+                    print('[HTTP STATUS:304] {} (elapsed={})'
+                          .format(url, response.elapsed))
+                    return path
+                if response.status_code == 416:
+                    # Partial download is no longer valid, start over
+                    os.remove(part)
+                    error = 'HTTP status 416'
+                    continue
+                if response.status_code in _retry_status:
+                    error = 'HTTP status {}'.format(response.status_code)
+                    continue
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                    with open(part+'.json', 'w') as f:
+                        json.dump(dict(url=url, **_validators(response)), f)
+                with open(part, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+        except requests.exceptions.HTTPError as http_error:
+            raise DownloadError('{}: {}'.format(url, http_error))
+        except requests.exceptions.RequestException as request_error:
+            error = request_error
+            continue
+        os.replace(part, path)
+        os.replace(part+'.json', path+'.json')
+        print('[HTTP STATUS:{}] {} (elapsed={})'
+              .format(response.status_code, url, response.elapsed))
+        return path
+    raise DownloadError('{}: failed after {} attempts ({})'
+                        .format(url, retries+1, error))
 
 
 def wraprint(*args, width=72, indent='  '):